@@ -0,0 +1,74 @@
+"""Tests of the binary columnar format of tools.files.columnar"""
+
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from tools.files import columnar
+from tools.files.columnar import ColumnarWriter, ColumnarReader
+from tools.files.definitions import SimpleColumnar, TupleWriter, TupleContainer
+
+SCHEMA = [('count', SimpleColumnar.INT),
+          ('usage', SimpleColumnar.FLOAT),
+          ('lastUpdate', SimpleColumnar.TIMESTAMP),
+          ('user', SimpleColumnar.STRING)]
+
+
+def rows(count):
+    return [(i, i * 0.5, datetime(2020, 1, 1, 0, 0, i % 60) if i % 7 else None, "u%d" % (i % 5) if i % 3 else None)
+            for i in range(count)]
+
+
+class ColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "usage.col")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, datas):
+        with ColumnarWriter.open(self.path, TupleWriter(), SCHEMA) as writer:
+            writer.writerows(datas)
+
+    def testRoundTrip(self):
+        datas = rows(25)
+        self.write(datas)
+        with ColumnarReader(self.path, TupleContainer()) as reader:
+            self.assertEqual(len(reader), 25)
+            self.assertEqual(reader.fieldnames, [name for name, columnType in SCHEMA])
+            self.assertEqual([row for batch in reader.batches(4) for row in batch], datas)
+            self.assertEqual(list(reader.rawColumn('count')), range(25))
+            self.assertEqual(reader.column('user'), [data[3] for data in datas])
+
+    def testWithoutIntArray(self):
+        # windows with python 2 has no array of 8 bytes integers
+        typecode = columnar._ARRAY_TYPECODES[SimpleColumnar.INT]
+        columnar._ARRAY_TYPECODES[SimpleColumnar.INT] = None
+        try:
+            self.write(rows(10))
+            with ColumnarReader(self.path) as reader:
+                self.assertEqual(list(reader.rawColumn('count')), range(10))
+                self.assertEqual([row for batch in reader.batches(3) for row in batch], rows(10))
+        finally:
+            columnar._ARRAY_TYPECODES[SimpleColumnar.INT] = typecode
+
+    def testBadRows(self):
+        with ColumnarWriter.open(self.path, TupleWriter(), SCHEMA) as writer:
+            writer.writerows(rows(2))
+            # rejected rows leave the columns unchanged
+            with self.assertRaisesRegexp(ValueError, "count"):
+                writer.writerow((None, 1.0, None, 'a'))
+            with self.assertRaisesRegexp(ValueError, "usage"):
+                writer.writerow((1, 'x', None, 'a'))
+            with self.assertRaisesRegexp(ValueError, "4 columns"):
+                writer.writerows([(1, 1.0, None, 'a'), (2, 2.0)])
+        with ColumnarReader(self.path) as reader:
+            self.assertEqual([row for batch in reader.batches() for row in batch], rows(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
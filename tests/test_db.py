@@ -0,0 +1,177 @@
+"""Tests of the transactions, retries and dead letters of tools.db"""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from tools.db import Database, Sqlite
+
+logging.getLogger().addHandler(logging.NullHandler())
+
+
+class FakeDriver(object):
+    """DB-API module whose connections keep the inserted values in memory, with savepoints"""
+
+    class Error(Exception):
+        pass
+
+    def __init__(self):
+        self.committed = []
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection(object):
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pending = []
+        self.savepoints = {}
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def insert(self, value):
+        self.pending.append(value)
+
+    def commit(self):
+        self.driver.committed.extend(self.pending)
+        self.pending = []
+        self.savepoints = {}
+
+    def rollback(self):
+        self.pending = []
+        self.savepoints = {}
+
+    def close(self):
+        pass
+
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, statement, params = ()):
+        connection = self.connection
+        connection.statements.append(statement)
+        command, name = statement.rsplit(" ", 1)
+        if command == "SAVEPOINT":
+            connection.savepoints[name] = len(connection.pending)
+        elif command == "ROLLBACK TO SAVEPOINT":
+            del connection.pending[connection.savepoints[name]:]
+
+    def close(self):
+        pass
+
+
+class Insert(object):
+    """Action inserting a value, failing the first failures times"""
+
+    def __init__(self, value, failures = 0):
+        self.value = value
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, connection, logger):
+        self.calls += 1
+        # the value is inserted before the failure, it must be rolled back
+        connection.insert(self.value)
+        if self.calls <= self.failures:
+            raise Exception("action %s failed" % self.value)
+
+
+class SavepointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.database = Database(Database.Configuration(self.driver))
+
+    def testFailingActionRolledBackAlone(self):
+        failing = Insert(2, failures = 1)
+        for action in (Insert(1), failing, Insert(3)):
+            self.database.addAction(action)
+        self.database.executeAll()
+        self.assertEqual(self.driver.committed, [1, 3])
+        self.assertEqual(list(self.database.actions), [failing])
+        self.database.executeAll()
+        self.assertEqual(self.driver.committed, [1, 3, 2])
+        self.assertEqual(len(self.database.actions), 0)
+        self.assertEqual(self.database._failures, {})
+
+    def testDeadLetters(self):
+        failing = Insert(1, failures = Database.MAX_ACTION_TRIES)
+        self.database.addAction(failing)
+        for _ in range(Database.MAX_ACTION_TRIES):
+            self.database.executeAll()
+        self.assertEqual(self.driver.committed, [])
+        self.assertEqual([action for action, error in self.database.deadLetters], [failing])
+        self.assertEqual(self.database._failures, {})
+
+    def testDiscard(self):
+        failing = Insert(1, failures = 1)
+        self.database.addAction(failing)
+        self.database.executeAll()
+        self.assertTrue(self.database.discard(failing))
+        self.assertFalse(self.database.discard(failing))
+        self.assertEqual(len(self.database.actions), 0)
+        self.assertEqual(self.database._failures, {})
+
+
+class SqliteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = Sqlite(Sqlite.Configuration(os.path.join(self.directory, "test.sqlite"), keepConnection = True))
+        self.database.addAction(lambda connection, logger: connection.execute("CREATE TABLE t (value INTEGER)"))
+        self.database.executeAll()
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.directory)
+
+    def values(self):
+        rows = []
+        self.database.addAction(lambda connection, logger: rows.extend(connection.execute("SELECT value FROM t ORDER BY value")))
+        self.database.executeAll()
+        return [row[0] for row in rows]
+
+    def insert(self, value, fail = False):
+        def action(connection, logger):
+            connection.execute("INSERT INTO t VALUES (?)", (value,))
+            if fail:
+                raise Exception("action %s failed" % value)
+        return action
+
+    def testFailingAction(self):
+        for action in (self.insert(1), self.insert(2, fail = True), self.insert(3)):
+            self.database.addAction(action)
+        self.database.executeAll()
+        self.assertEqual(self.values(), [1, 3])
+        self.assertEqual(len(self.database.actions), 1)
+
+    def testBatch(self):
+        batch = self.database.addBatch("INSERT INTO t VALUES (?)", [(i,) for i in range(25)], chunkSize = 10)
+        self.database.executeAll()
+        self.assertEqual(self.values(), range(25))
+        self.assertEqual(batch.rowCount, 25)
+
+    def testBatchWithFailingRows(self):
+        def rows():
+            for i in range(5):
+                yield (i,)
+            raise ValueError("bad source")
+        batch = self.database.addBatch("INSERT INTO t VALUES (?)", rows(), chunkSize = 2)
+        self.database.executeAll()
+        # the chunks read before the error are committed, the batch is not retried
+        self.assertEqual(self.values(), range(4))
+        self.assertEqual(len(self.database.actions), 0)
+        self.assertEqual([action for action, error in self.database.deadLetters], [batch])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Tests of the FLEXlm log tailer and its event store"""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from tools.monitoring.flexlog import FlexLogTailer, FlexEventStore
+
+logging.getLogger().addHandler(logging.NullHandler())
+
+HEADER = '10:00:00 (lmgrd) TIMESTAMP 3/21/2011\n'
+OUT = '10:00:01 (telelogic) OUT: "DOORS" SBX035@HOST\n'
+
+
+class _FailingCommit(object):
+    """Connection whose commits fail"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def commit(self):
+        raise Exception("commit failed")
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class FlexLogTailerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "flex.log")
+        self.store = FlexEventStore.open(os.path.join(self.directory, "events.sqlite"))
+        self.write(HEADER, 'wb')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, data, mode = 'ab'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def testSameSecondEvents(self):
+        self.write(OUT + OUT)
+        tailer = FlexLogTailer(self.path, self.store)
+        self.assertEqual(tailer.poll(), 2)
+        self.assertEqual(len(self.store.events(user = 'SBX035')), 2)
+
+    def testResumeFromCheckpoint(self):
+        self.write(OUT)
+        FlexLogTailer(self.path, self.store).poll()
+        self.write('10:00:02 (telelogic) IN: "DOORS" SBX035@HOST\n10:00:03 (telelogic) IN: "DO')
+        tailer = FlexLogTailer(self.path, self.store)
+        self.assertEqual(tailer.poll(), 1)
+        self.write('ORS" SBX036@HOST\n')
+        self.assertEqual(tailer.poll(), 1)
+        self.assertEqual(tailer.poll(), 0)
+        self.assertEqual([event.action for event in self.store.events()], ['OUT', 'IN', 'IN'])
+
+    def testRotation(self):
+        self.write(OUT)
+        tailer = FlexLogTailer(self.path, self.store)
+        tailer.poll()
+        # a new file starting with the same bytes
+        os.rename(self.path, self.path + ".old")
+        self.write(HEADER + OUT, 'wb')
+        self.assertEqual(tailer.poll(), 1)
+        self.assertEqual(len(self.store.events()), 2)
+
+    def testMerge(self):
+        self.write(OUT)
+        tailer = FlexLogTailer(self.path, self.store)
+        tailer.poll()
+        with open(self.path, 'rb') as f:
+            saved = f.read()
+        # restart of the server : new log, then the saved log is prepended
+        newLog = '11:00:00 (lmgrd) TIMESTAMP 3/22/2011\n11:00:01 (telelogic) OUT: "DOORS" NEW@HOST\n'
+        self.write(newLog, 'wb')
+        self.assertEqual(tailer.poll(), 1)
+        self.write(saved + newLog, 'wb')
+        self.assertEqual(tailer.poll(), 1)
+        self.assertEqual(tailer.offset, len(saved + newLog))
+        self.assertEqual([event.user for event in self.store.events()], ['SBX035', 'NEW'])
+
+    def testFailedCommit(self):
+        database = self.store.database
+        tailer = FlexLogTailer(self.path, self.store)
+        tailer.poll()
+        offset = tailer.offset
+        self.write(OUT)
+        database.connection = _FailingCommit(database.connection)
+        self.assertEqual(tailer.poll(), 0)
+        self.assertEqual(tailer.offset, offset)
+        self.assertEqual(len(database.actions), 0)
+        self.assertEqual(database._failures, {})
+        database.connection = database.connection._connection
+        self.assertEqual(tailer.poll(), 1)
+        self.assertEqual(FlexLogTailer(self.path, self.store).offset, len(HEADER + OUT))
+
+
+if __name__ == '__main__':
+    unittest.main()
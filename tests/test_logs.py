@@ -0,0 +1,96 @@
+"""Tests of the asynchronous logging of tools.logs"""
+
+import logging
+import os
+import shutil
+import tempfile
+from threading import Event
+import unittest
+
+from tools.logs import AsyncHandler, _FlushRequest
+
+
+class BlockingHandler(logging.Handler):
+    """Handler waiting for its gate before handling its first record"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.started = Event()
+        self.gate = Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.started.set()
+        self.gate.wait()
+        self.messages.append(record.getMessage())
+
+
+class AsyncHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.logger = logging.getLogger("tests.asynchandler.%s" % self.id())
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.raiseExceptions = logging.raiseExceptions
+        # handleError prints the errors of bad log calls on stderr
+        logging.raiseExceptions = False
+
+    def tearDown(self):
+        logging.raiseExceptions = self.raiseExceptions
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        shutil.rmtree(self.directory)
+
+    def testBatchedFile(self):
+        path = os.path.join(self.directory, "async.log")
+        fileHandler = logging.FileHandler(path)
+        fileHandler.setLevel(logging.INFO)
+        handler = AsyncHandler([fileHandler], flushSize = 3)
+        self.logger.addHandler(handler)
+        self.logger.debug("hidden")
+        for i in range(10):
+            self.logger.info("record %s", i)
+        handler.flush()
+        with open(path) as f:
+            self.assertEqual(f.read().splitlines(), ["record %s" % i for i in range(10)])
+
+    def testBadRecord(self):
+        path = os.path.join(self.directory, "async.log")
+        handler = AsyncHandler([logging.FileHandler(path)], flushSize = 10)
+        self.logger.addHandler(handler)
+        self.logger.info("first")
+        self.logger.info("bad %s %s", 1)
+        self.logger.info("last")
+        handler.flush()
+        with open(path) as f:
+            self.assertEqual(f.read().splitlines(), ["first", "last"])
+
+    def testDropOldest(self):
+        target = BlockingHandler()
+        handler = AsyncHandler([target], maxQueueSize = 2, flushSize = 1, dropPolicy = AsyncHandler.DROP_OLDEST)
+        self.logger.addHandler(handler)
+        self.logger.info("written")
+        target.started.wait(5)
+        self.logger.info("dropped")
+        self.logger.info("kept")
+        self.logger.info("last")
+        self.assertEqual(handler.dropped, 1)
+        # flush requests are never dropped, a record is dropped instead when they fill the queue
+        handler.queue.get_nowait()
+        handler.queue.get_nowait()
+        requests = [_FlushRequest(), _FlushRequest()]
+        for request in requests:
+            handler.queue.put_nowait(request)
+        self.logger.info("no room")
+        self.assertEqual(handler.dropped, 2)
+        target.gate.set()
+        for request in requests:
+            self.assertTrue(request.done.wait(5))
+        handler.flush()
+        self.assertEqual(target.messages, ["written"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""Tests of the read paths of tools.files.reader"""
+
+import cPickle
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tools.files.definitions import TupleContainer, ListContainer, ObjectContainer, FetchableObject
+from tools.files.reader import TsvReader, IndexedReader, ParallelReader
+
+
+class Usage(FetchableObject):
+
+    def setUser(self, user):
+        self.user = user
+
+    def setCount(self, count):
+        self.count = int(count)
+
+
+class StructuredReaderTest(unittest.TestCase):
+
+    CONTENT = "user\tcount\n\nalice\t1\nbob\t2\n\n\ncarol\t3\n\n"
+    ROWS = [('alice', 1), ('bob', 2), ('carol', 3)]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "usage.tsv")
+        with open(self.path, 'wb') as f:
+            f.write(self.CONTENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def container(self):
+        return TupleContainer([str, int])
+
+    def testRows(self):
+        with TsvReader.open(self.path, self.container()) as reader:
+            self.assertEqual(list(reader), self.ROWS)
+
+    def testBatches(self):
+        with TsvReader.open(self.path, self.container()) as reader:
+            batches = list(reader.batches(2))
+        self.assertEqual([row for batch in batches for row in batch], self.ROWS)
+
+    def testColumnBatches(self):
+        with TsvReader.open(self.path, self.container()) as reader:
+            batches = list(reader.columnBatches(2))
+        self.assertEqual([row for batch in batches for row in zip(*batch)], self.ROWS)
+
+    def testListContainer(self):
+        with TsvReader.open(self.path, ListContainer([str, int])) as reader:
+            self.assertEqual([tuple(row) for batch in reader.batches(2) for row in batch], self.ROWS)
+
+    def testInferredBatches(self):
+        with TsvReader.open(self.path, TupleContainer(inferSchema = True)) as reader:
+            self.assertEqual([row for batch in reader.batches() for row in batch], self.ROWS)
+
+    def testObjectBatches(self):
+        container = ObjectContainer(Usage, {'setUser': ['user'], 'setCount': ['count']})
+        with TsvReader.open(self.path, container) as reader:
+            rows = [(usage.user, usage.count) for batch in reader.batches(2) for usage in batch]
+        self.assertEqual(rows, self.ROWS)
+        with TsvReader.open(self.path, container) as reader:
+            self.assertEqual([(usage.user, usage.count) for usage in reader], self.ROWS)
+
+    def testParallel(self):
+        for processes in (1, 2):
+            reader = ParallelReader(self.path, self.container(), processes = processes, chunkSize = 8)
+            self.assertEqual(list(reader), self.ROWS)
+
+
+class IndexedReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "usage.csv")
+        self.write("user;count\nalice;1\nbob;2\nalice;3\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, content):
+        with open(self.path, 'wb') as f:
+            f.write(content)
+
+    def reader(self):
+        return IndexedReader(self.path, TupleContainer([str, int]), keyColumn = 'user')
+
+    def testLookup(self):
+        reader = self.reader()
+        try:
+            self.assertEqual(len(reader), 3)
+            self.assertEqual(reader[1], ('bob', 2))
+            self.assertEqual(reader.lookup('alice'), [('alice', 1), ('alice', 3)])
+            self.assertEqual(reader.lookup('carol'), [])
+        finally:
+            reader.close()
+        self.assertTrue(os.path.exists(self.path + IndexedReader.INDEX_EXTENSION))
+
+    def testSavedIndex(self):
+        self.reader().close()
+        indexPath = self.path + IndexedReader.INDEX_EXTENSION
+        with open(indexPath, 'rb') as f:
+            index = cPickle.load(f)
+        self.assertEqual(index['version'], IndexedReader.INDEX_VERSION)
+        # the saved index is used as long as the file does not change
+        index['keys'] = {'alice': [1]}
+        with open(indexPath, 'wb') as f:
+            cPickle.dump(index, f)
+        reader = self.reader()
+        self.assertEqual(reader.lookup('alice'), [('bob', 2)])
+        reader.close()
+
+    def testRebuild(self):
+        self.reader().close()
+        indexPath = self.path + IndexedReader.INDEX_EXTENSION
+        # a changed file
+        self.write("user;count\ncarol;4\n")
+        os.utime(self.path, (time.time() + 10, time.time() + 10))
+        reader = self.reader()
+        self.assertEqual(reader.lookup('carol'), [('carol', 4)])
+        reader.close()
+        # an index of another version
+        with open(indexPath, 'rb') as f:
+            index = cPickle.load(f)
+        index['version'] = IndexedReader.INDEX_VERSION - 1
+        index['keys'] = {}
+        with open(indexPath, 'wb') as f:
+            cPickle.dump(index, f)
+        reader = self.reader()
+        self.assertEqual(reader.lookup('carol'), [('carol', 4)])
+        reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
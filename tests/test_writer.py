@@ -0,0 +1,62 @@
+"""Tests of the conversions of the writers of tools.files.writer"""
+
+from StringIO import StringIO
+import unittest
+
+from tools.files.definitions import ObjectWriter, TupleWriter, ListWriter, WriteableObject
+from tools.files.writer import TsvWriter
+
+
+class Usage(WriteableObject):
+
+    def __init__(self, user, count):
+        self.user = user
+        self.count = count
+
+
+class UpperTupleWriter(TupleWriter):
+
+    def write(self, data):
+        return [str(value).upper() for value in data]
+
+
+class UpperListWriter(ListWriter):
+
+    def write(self, data):
+        return [str(value).upper() for value in data]
+
+
+class UpperObjectWriter(ObjectWriter):
+
+    def write(self, obj):
+        row = ObjectWriter.write(self, obj)
+        row['user'] = row['user'].upper()
+        return row
+
+
+class WriterTest(unittest.TestCase):
+
+    def written(self, container, datas):
+        f = StringIO()
+        writer = TsvWriter(f, container, bufferSize = 1024)
+        writer.writerow(datas[0])
+        writer.writerows(datas[1:])
+        writer.flush()
+        return f.getvalue().splitlines()
+
+    def testTuples(self):
+        self.assertEqual(self.written(TupleWriter(), [('a', 1), ('b', 2)]), ['a\t1', 'b\t2'])
+
+    def testObjects(self):
+        usages = [Usage('a', 1), Usage('b', 2)]
+        self.assertEqual(self.written(ObjectWriter(Usage, {'user': 'user'}), usages), ['a', 'b'])
+
+    def testOverriddenWrite(self):
+        self.assertEqual(self.written(UpperTupleWriter(), [('a', 1), ('b', 2)]), ['A\t1', 'B\t2'])
+        self.assertEqual(self.written(UpperListWriter(), [['a', 1], ['b', 2]]), ['A\t1', 'B\t2'])
+        usages = [Usage('a', 1), Usage('b', 2)]
+        self.assertEqual(self.written(UpperObjectWriter(Usage, {'user': 'user'}), usages), ['A', 'B'])
+
+
+if __name__ == '__main__':
+    unittest.main()
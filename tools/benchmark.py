@@ -0,0 +1,271 @@
+"""Benchmarks of the tools
+
+Run with : python -m tools.benchmark [name ...]
+without names, all the benchmarks are run
+
+"""
+
+__all__ = ['benchmarkReaders', 'benchmarkParallelReader', 'benchmarkContainers', 'benchmarkWriters', 'benchmarkLogging',
+           'benchmarkFormatters', 'benchmarkConsole']
+
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from tools.files.definitions import TupleContainer, ListContainer, ObjectContainer, FetchableObject
+from tools.files.definitions import TupleWriter, ListWriter, ObjectWriter, WriteableObject
+from tools.files.reader import CsvReader, TsvReader, ParallelReader
+from tools.files.writer import CsvWriter
+from tools.system import Console
+from tools.logs import addBasicLog, addAsyncLogging, CachedTimeFormatter, JsonFormatter
+from tools.logs import DEFAULT_LOG_FORMAT, DEFAULT_LOG_DATE_FORMAT
+
+BENCHMARK_ROWS = 200000
+
+
+def _tempPath(suffix):
+    fd, path = tempfile.mkstemp(suffix = suffix)
+    os.close(fd)
+    return path
+
+
+def _report(label, count, elapsed, unit = "rows"):
+    if elapsed <= 0:
+        elapsed = 1e-9
+    print("%-45s %10.0f %s in %7.3fs : %12.1f %s/s" % (label, count, unit, elapsed, count / elapsed, unit))
+
+
+def _timed(function):
+    start = time.time()
+    result = function()
+    return result, time.time() - start
+
+
+class _UsageRecord(FetchableObject):
+    def setUser(self, uid, machine):
+        self.uid = uid
+        self.machine = machine
+
+    def setServer(self, server):
+        self.server = server
+
+    def setUsage(self, hours, sessions):
+        self.hours = float(hours)
+        self.sessions = int(sessions)
+
+
+_USAGE_HEADER = ['uid', 'machine', 'server', 'date', 'hours', 'sessions']
+_USAGE_CONSTRAINTS = [str, str, str, str, float, int]
+_USAGE_MAPPINGS = {'setUser': ['uid', 'machine'], 'setServer': ['server'], 'setUsage': ['hours', 'sessions']}
+
+
+def _writeUsageFile(path, rows, delimiter = ';'):
+    with open(path, 'wb') as f:
+        f.write(delimiter.join(_USAGE_HEADER) + '\r\n')
+        for i in xrange(rows):
+            f.write(delimiter.join(['SBX%04d' % (i % 5000), 'VSDS-BIE-L%04d' % (i % 700), 'BIE-PVCS-01',
+                                    '2013-09-%02d' % (i % 28 + 1), '%.2f' % (i % 1000 / 7.0), str(i % 13)]) + '\r\n')
+
+
+def _usageContainers():
+    return [("tuple", TupleContainer(_USAGE_CONSTRAINTS)),
+            ("list", ListContainer(_USAGE_CONSTRAINTS)),
+            ("object", ObjectContainer(_UsageRecord, _USAGE_MAPPINGS))]
+
+
+def benchmarkReaders(rows = BENCHMARK_ROWS):
+    """Rows/sec of the row by row reader against the batch reader, for each container type"""
+    path = _tempPath(".csv")
+    try:
+        _writeUsageFile(path, rows)
+        for name, container in _usageContainers():
+            with open(path, 'rb') as f:
+                count, elapsed = _timed(lambda: sum(1 for _ in CsvReader(f, container)))
+            _report("reader %s, row by row" % name, count, elapsed)
+            with open(path, 'rb') as f:
+                count, elapsed = _timed(lambda: sum(len(b) for b in CsvReader(f, container).batches()))
+            _report("reader %s, batches" % name, count, elapsed)
+            if name != "object":
+                with open(path, 'rb') as f:
+                    count, elapsed = _timed(lambda: sum(len(b[0]) for b in CsvReader(f, container).columnBatches()))
+                _report("reader %s, column batches" % name, count, elapsed)
+    finally:
+        os.remove(path)
+
+
+def benchmarkParallelReader(rows = BENCHMARK_ROWS * 5):
+    """Rows/sec of the parallel reader of a tsv file, for an increasing number of processes"""
+    path = _tempPath(".tsv")
+    try:
+        _writeUsageFile(path, rows, delimiter = '\t')
+        container = TupleContainer(_USAGE_CONSTRAINTS)
+        with open(path, 'rb') as f:
+            count, elapsed = _timed(lambda: sum(len(b) for b in TsvReader(f, container).batches()))
+        _report("tsv reader, batches", count, elapsed)
+        processes = 1
+        while processes <= multiprocessing.cpu_count():
+            reader = ParallelReader(path, container, processes = processes, chunkSize = 1024 * 1024)
+            count, elapsed = _timed(lambda: sum(len(b) for b in reader.batches()))
+            _report("parallel tsv reader, %s processes" % processes, count, elapsed)
+            processes *= 2
+    finally:
+        os.remove(path)
+
+
+class _WideRecord(FetchableObject):
+    def set(self, value):
+        self.value = value
+
+
+def _loopObjectFetch(container, d):
+    """Row conversion of ObjectContainer before it was compiled, for comparison"""
+    obj = container.object
+    for method, args in container.mappings.iteritems():
+        getattr(obj, method)(*[d[arg] for arg in args])
+    return obj
+
+
+def _loopConstrainedFetch(container, datas):
+    """Row conversion of ConstrainedContainer before it was compiled, for comparison"""
+    for i in range(0, len(datas)):
+        datas[i] = container.constraints[i](datas[i])
+    return tuple(datas)
+
+
+def benchmarkContainers(rows = BENCHMARK_ROWS / 4, width = 50):
+    """Rows/sec of the row conversion of the containers on wide rows, loop against compiled converters"""
+    header = ['column%d' % i for i in range(width)]
+    values = [str(i) for i in range(width)]
+    container = TupleContainer([int] * width)
+    count, elapsed = _timed(lambda: sum(1 for _ in xrange(rows) if _loopConstrainedFetch(container, list(values))))
+    _report("tuple container %s columns, loop" % width, count, elapsed)
+    count, elapsed = _timed(lambda: sum(1 for _ in xrange(rows) if container.fetch(list(values))))
+    _report("tuple container %s columns, compiled" % width, count, elapsed)
+
+    # one setter per column, called by name
+    methods = dict(('set%d' % i, _WideRecord.__dict__['set']) for i in range(width))
+    wideClass = type('_Wide%d' % width, (_WideRecord,), methods)
+    container = ObjectContainer(wideClass, dict(('set%d' % i, [header[i]]) for i in range(width)))
+    d = dict(zip(header, values))
+    count, elapsed = _timed(lambda: sum(1 for _ in xrange(rows) if _loopObjectFetch(container, d)))
+    _report("object container %s columns, loop" % width, count, elapsed)
+    count, elapsed = _timed(lambda: sum(1 for _ in xrange(rows) if container.fetch(d)))
+    _report("object container %s columns, compiled" % width, count, elapsed)
+
+
+class _WrittenUsage(WriteableObject):
+    def __init__(self, i):
+        self.uid = 'SBX%04d' % (i % 5000)
+        self.machine = 'VSDS-BIE-L%04d' % (i % 700)
+        self.server = 'BIE-PVCS-01'
+        self.date = '2013-09-%02d' % (i % 28 + 1)
+        self.hours = i % 1000 / 7.0
+        self.sessions = i % 13
+
+    def values(self):
+        return [self.uid, self.machine, self.server, self.date, self.hours, self.sessions]
+
+
+def benchmarkWriters(rows = BENCHMARK_ROWS):
+    """MB/sec of the writers, row by row against buffered batches, for each writer type"""
+    objects = [_WrittenUsage(i) for i in xrange(rows)]
+    writers = [("object", ObjectWriter(_WrittenUsage, dict((name, name) for name in _USAGE_HEADER)), objects),
+               ("tuple", TupleWriter(_USAGE_HEADER), [tuple(o.values()) for o in objects]),
+               ("list", ListWriter(_USAGE_HEADER), [o.values() for o in objects])]
+    path = _tempPath(".csv")
+    try:
+        for name, container, datas in writers:
+            def rowByRow():
+                with open(path, 'wb') as f:
+                    writer = CsvWriter(f, container)
+                    for data in datas:
+                        writer.writerow(data)
+
+            def buffered():
+                with open(path, 'wb') as f:
+                    writer = CsvWriter(f, container, bufferSize = CsvWriter.DEFAULT_BUFFER_SIZE)
+                    writer.writerows(datas)
+                    writer.flush()
+
+            for label, function in (("row by row", rowByRow), ("buffered batches", buffered)):
+                _, elapsed = _timed(function)
+                _report("writer %s, %s" % (name, label), os.path.getsize(path) / 1048576.0, elapsed, "MB")
+    finally:
+        os.remove(path)
+
+
+def benchmarkLogging(records = BENCHMARK_ROWS / 2):
+    """Records/sec seen by the logging thread, file handler against the same handler behind an AsyncHandler"""
+    path = _tempPath(".log")
+    try:
+        for label, asynchronous in (("synchronous file log", False), ("asynchronous file log", True)):
+            logger = logging.getLogger("tools.benchmark.%s" % asynchronous)
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            addBasicLog(path, logger = logger)
+            asyncHandler = None
+            if asynchronous:
+                asyncHandler = addAsyncLogging(logger, maxQueueSize = records, dropPolicy = 'block')
+
+            def log():
+                for i in xrange(records):
+                    logger.info("Total licenses read for host %s : %s/%s", 'bie-pvcs-01', i % 56, 56)
+
+            _, elapsed = _timed(log)
+            _report(label, records, elapsed, "records")
+            if asyncHandler is not None:
+                print("%-45s %10.1f us average, %.1f us max, %s dropped" % ("enqueue latency", asyncHandler.averageEnqueueTime * 1e6,
+                                                                           asyncHandler.maxEnqueueTime * 1e6, asyncHandler.dropped))
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+    finally:
+        os.remove(path)
+
+
+def benchmarkFormatters(records = BENCHMARK_ROWS):
+    """Records/sec of the formatters, strftime per record against the formatters caching the time"""
+    start = time.time()
+    logRecords = [logging.LogRecord("tools.benchmark", logging.INFO, __file__, 0, "Total licenses read for host %s : %s/%s",
+                                    ('bie-pvcs-01', i % 56, 56), None) for i in xrange(records)]
+    # records of a monitoring run, spread on a few seconds
+    for i, record in enumerate(logRecords):
+        record.created = start + i / 50000.0
+    formatters = [("default formatter (strftime per record)", logging.Formatter(DEFAULT_LOG_FORMAT, DEFAULT_LOG_DATE_FORMAT)),
+                  ("formatter with cached time", CachedTimeFormatter(DEFAULT_LOG_FORMAT, DEFAULT_LOG_DATE_FORMAT)),
+                  ("json formatter", JsonFormatter())]
+    for label, formatter in formatters:
+        count, elapsed = _timed(lambda: sum(1 for record in logRecords if formatter.format(record)))
+        _report(label, count, elapsed, "records")
+
+
+def benchmarkConsole(commands = 500):
+    """Commands/sec of the console, a shell spawned per command against a persistent shell"""
+    command = "echo Flexible License Manager status"
+    count, elapsed = _timed(lambda: sum(1 for _ in xrange(commands) if Console.spawnCommand(command).getResult()))
+    _report("console, shell per command", count, elapsed, "commands")
+    if not Console.startWorkers():
+        print("persistent shells not available on this platform")
+        return
+    try:
+        count, elapsed = _timed(lambda: sum(1 for _ in xrange(commands) if Console.sendCommand(command).getResult()))
+        _report("console, persistent shell", count, elapsed, "commands")
+    finally:
+        Console.stopWorkers()
+
+
+BENCHMARKS = {'readers': benchmarkReaders,
+              'writers': benchmarkWriters,
+              'parallel': benchmarkParallelReader,
+              'containers': benchmarkContainers,
+              'logging': benchmarkLogging,
+              'formatters': benchmarkFormatters,
+              'console': benchmarkConsole}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+    for benchmarkName in names:
+        BENCHMARKS[benchmarkName]()
@@ -1,110 +1,711 @@
 """Module regrouping diverse db interface
 
-Currently implemented : oracle
+Database is the driver neutral core, it works with any DB-API 2.0 (PEP 249) driver
+Drivers are imported lazily, on first connection, so that importing this module
+never requires a database client to be installed
+
+Currently implemented : oracle (cx_Oracle), sqlite (sqlite3)
 
 """
 
-__all__ = ['Oracle']
+__all__ = ['Database', 'Oracle', 'Sqlite', 'BatchAction', 'StatementCache', 'importDriver']
 
 import logging
-from collections import deque
+from collections import deque, OrderedDict
+from threading import Thread, Event
+from Queue import Queue, Empty
+import importlib
+import itertools
+import sys
 import time
 
-import cx_Oracle
+_drivers = {}
+
+
+def importDriver(driver):
+    """Returns the DB-API module for driver, importing it on first use
+
+    driver - name of the module (eg. cx_Oracle) or an already imported module
+
+    """
+    if not isinstance(driver, basestring):
+        return driver
+    if not _drivers.has_key(driver):
+        _drivers[driver] = importlib.import_module(driver)
+    return _drivers[driver]
 
 
-class Oracle(object):
-    """Object that does query on a oracle database
+class Database(object):
+    """Object that does query on a database through a DB-API 2.0 driver
         Load the query (as a method) with addAction and execute with executeAll or executeOne
         
     """
 
     MAX_CONNECT_TRIES = 3
     WAIT_TIME = 60
+    TRANSACTION_SIZE = 100
+    MAX_ACTION_TRIES = 3
+    SAVEPOINTS = True
 
     def __init__(self, config):
-        """Creates a new Oracle interface
+        """Creates a new Database interface
         
-        config - configuration data, instance of Oracle.Configuration
+        config - configuration data, instance of Database.Configuration
         
         """
         self.connection = None
         self.actions = deque()
-        assert isinstance(config, Oracle.Configuration)
+        self.deadLetters = deque()
+        self._failures = {}
+        assert isinstance(config, Database.Configuration)
         self.config = config
         self.logger = config.getLogger()
         self.connectionAttempts = 0
+        self.writer = None
+        self.statements = {}
+        self.statementCache = StatementCache(config.getStatementCacheSize())
 
     def addAction(self, method):
         """Add an action (as callable object) to be performed on the database
         the following parameters are supplied : connection (to the db) and logger (for logging)
+        Transactions are handled by executeAll, an action that commits by itself must have
+        a true commits attribute (see BatchAction)
+
+        In write-behind mode, the action is handed to the writer thread, this blocks while the writer
+        queue is full (backpressure)
         
         """
         self.logger.debug("Adding action to buffer")
-        self.actions.append(method)
+        if self.writer is not None:
+            self.writer.put(method)
+        else:
+            self.actions.append(method)
+
+    def startWriteBehind(self, maxQueueSize = None, flushSize = None, flushInterval = None):
+        """Switch to write-behind mode: actions are executed by a background writer thread
+        (see Database.WriteBehind), executeAll and executeOne only request a flush and return
+
+        maxQueueSize - number of actions waiting for the writer before addAction blocks
+        flushSize - number of buffered actions that triggers a flush
+        flushInterval - maximum time (in seconds) between two flushes
+
+        While write-behind is on, only the writer thread opens and closes the connection
+        (connections can not be shared between threads)
+
+        """
+        if self.writer is not None:
+            return
+        # a connection kept open by this thread must not be used by the writer
+        self._close(force = True)
+        self.writer = Database.WriteBehind(self, maxQueueSize, flushSize, flushInterval)
+        self.writer.start()
+
+    def stopWriteBehind(self):
+        """Execute all pending actions and stop the writer thread"""
+        if self.writer is None:
+            return
+        self.writer.terminate()
+        self.writer = None
+
+    def drain(self):
+        """Wait until all the actions added so far have been executed (write-behind mode)
+        Does the same as executeAll otherwise
+
+        """
+        if self.writer is not None:
+            self.writer.drain()
+        else:
+            self._executeAll()
+
+    def discard(self, action):
+        """Removes an action that has not been executed successfully (pending, put back to be retried
+        or dead), returns whether it was found
+
+        """
+        self._failures.pop(id(action), None)
+        found = False
+        if action in self.actions:
+            self.actions.remove(action)
+            found = True
+        for letter in list(self.deadLetters):
+            if letter[0] is action:
+                self.deadLetters.remove(letter)
+                found = True
+        return found
+
+    def addBatch(self, statement, rows, chunkSize = None):
+        """Add an action executing statement once for each row of rows (see BatchAction)
+        returns the BatchAction, which holds the statistics once executed
+
+        statement - the statement (with bind variables) to execute
+        rows - iterable of rows (sequences or dicts of bind values), consumed lazily
+        chunkSize - number of rows sent (and committed) at once
+
+        """
+        batch = BatchAction(statement, rows, chunkSize, self.statementCache)
+        self.addAction(batch)
+        return batch
+
+    def registerStatement(self, name, statement):
+        """Register a parameterised statement under name, to be used with addStatement and addStatementBatch"""
+        self.statements[name] = statement
+
+    def getStatement(self, name):
+        """Returns the statement registered under name"""
+        try:
+            return self.statements[name]
+        except KeyError:
+            raise Exception("Unknown statement : %s" % name)
+
+    def addStatement(self, name, params = None):
+        """Add an action executing the statement registered under name with params
+        The statement goes through the statement cache, it is only parsed once per connection
+
+        name - name of the statement (see registerStatement)
+        params - bind values (sequence or dict)
+
+        """
+        statement = self.getStatement(name)
+        if params is None: params = ()
+        cache = self.statementCache
+        self.addAction(lambda connection, logger: cache.execute(statement, params))
+
+    def addStatementBatch(self, name, rows, chunkSize = None):
+        """Same as addBatch, for the statement registered under name"""
+        return self.addBatch(self.getStatement(name), rows, chunkSize)
+
+    def close(self):
+        """Close the connection kept open between executions (see Configuration keepConnection)
+        In write-behind mode, the writer executes the pending actions then closes its connection
+
+        """
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            self._close(force = True)
 
     def executeAll(self):
-        """Executes all actions in the buffer (self.actions) in FIFO order"""
+        """Executes all actions in the buffer (self.actions) in FIFO order
+        In write-behind mode, only request the writer to flush (does not block)
+
+        Actions are grouped in transactions of TRANSACTION_SIZE actions, each action runs in its own
+        savepoint so that a failing action is rolled back alone
+        Successful actions are removed from the buffer, failed actions are put back at the end of the
+        buffer (to be retried on the next call) until they failed MAX_ACTION_TRIES times,
+        they are then moved to self.deadLetters (at once for actions whose retryable attribute is False)
+
+        """
+        if self.writer is not None:
+            self.writer.flush()
+        else:
+            self._executeAll()
+
+    def _executeAll(self):
+        if len(self.actions) == 0:
+            return
         try:
-            self.__connect()
-            # execute db actions
-            for method in self.actions:
-                self.__execute(method)
+            self._connect()
+            # only the actions present now, retried actions wait for the next call
+            remaining = len(self.actions)
+            while remaining > 0:
+                group = [self.actions.popleft() for _ in range(min(remaining, self.TRANSACTION_SIZE))]
+                remaining -= len(group)
+                remaining += self._executeTransaction(group)
         except Exception as e:
             self.logger.error("Could not contact the database : %s", e)
+            self._close(force = True)
         finally:
-            self.__close()
+            self._close()
 
     def executeOne(self):
-        """Executes the first action of the queue (FIFO)"""
+        """Executes the first action of the queue (FIFO) in its own transaction
+        In write-behind mode, only request the writer to flush (does not block)
+        """
+        if self.writer is not None:
+            self.writer.flush()
+            return
         try:
-            self.__connect()
-            # insert monthly update of license usage
-            self.__execute(self.actions.popleft())
+            self._connect()
+            if len(self.actions) > 0:
+                self._executeTransaction([self.actions.popleft()])
 
         except Exception as e:
             self.logger.error("Could not contact the database : %s", e)
+            self._close(force = True)
+        finally:
+            self._close()
+
+    def _executeTransaction(self, group):
+        """Executes the actions of group in one transaction
+        returns the number of actions put back (untouched) in front of the buffer
+
+        """
+        applied = []
+        for index, action in enumerate(group):
+            # the action commits by itself, make what was done so far durable and run it alone
+            if getattr(action, 'commits', False):
+                self._commit(applied)
+                applied = []
+                try:
+                    self._execute(action)
+                    self._succeed(action)
+                except Exception as e:
+                    self._rollback()
+                    self._fail(action, e)
+                continue
+
+            savepoint = "action_%d" % index
+            try:
+                if self.SAVEPOINTS:
+                    self._savepoint(savepoint)
+                self._execute(action)
+                applied.append(action)
+            except Exception as e:
+                if self.SAVEPOINTS and self._rollbackTo(savepoint):
+                    self._fail(action, e)
+                    continue
+                # the whole transaction is lost, put the other actions back to be executed again
+                self._rollback()
+                self._fail(action, e)
+                putBack = applied + group[index + 1:]
+                self.actions.extendleft(reversed(putBack))
+                return len(putBack)
+        self._commit(applied)
+        return 0
+
+    def _commit(self, applied):
+        """Commits the current transaction, applied actions are failed if the commit fails"""
+        try:
+            if not self.config.isMock():
+                self.connection.commit()
+        except Exception as e:
+            self._rollback()
+            for action in applied:
+                self._fail(action, e)
+            return
+        for action in applied:
+            self._succeed(action)
+
+    def _rollback(self):
+        try:
+            self.connection.rollback()
+        except Exception as e:
+            self.logger.warning("Error while rolling back the transaction : %s", e)
+
+    def _savepoint(self, name):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT %s" % name)
+        finally:
+            cursor.close()
+
+    def _rollbackTo(self, name):
+        """Rolls back to the savepoint name, returns whether it succeeded"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("ROLLBACK TO SAVEPOINT %s" % name)
+            return True
+        except Exception as e:
+            self.logger.warning("Could not roll back to savepoint %s : %s", name, e)
+            return False
         finally:
-            self.__close()
+            cursor.close()
+
+    def _succeed(self, action):
+        self._failures.pop(id(action), None)
+
+    def _fail(self, action, error):
+        """Puts a failed action back in the buffer, or in self.deadLetters if it failed too often or can not be retried"""
+        tries = self._failures.pop(id(action), 0) + 1
+        if not getattr(action, 'retryable', True):
+            self.logger.error("Action failed and can not be retried, giving up : %s", error)
+            self.deadLetters.append((action, error))
+        elif tries >= self.MAX_ACTION_TRIES:
+            self.logger.error("Action failed %s times, giving up : %s", tries, error)
+            self.deadLetters.append((action, error))
+        else:
+            self.logger.warning("Action failed (%s/%s), will be retried : %s", tries, self.MAX_ACTION_TRIES, error)
+            self._failures[id(action)] = tries
+            self.actions.append(action)
 
-    def __execute(self, action):
+    def _execute(self, action):
         if not self.config.isMock():
             self.logger.debug("Executing query")
             action(self.connection, self.logger)
 
-    def __connect(self):
+    def _connect(self):
+        if self.connection is not None:
+            return
         self.logger.debug("Contacting the database...")
+        driver = self.config.getDriver()
+        args, kwargs = self.config.getConnectionParam()
         # try to connect a couple of times
-        while self.connectionAttempts < self.MAX_CONNECT_TRIES:
+        self.connectionAttempts = 0
+        while True:
             try:
-                self.connection = cx_Oracle.connect(*self.config.getConnectionParam())
+                self.connection = driver.connect(*args, **kwargs)
                 self.connectionAttempts = 0
                 break
-            except cx_Oracle.Error as e:
-                error, = e.args
-                self.logger.error("Could not contact the database : %s, %s, %s", error.code, error.message, error.context)
-                if self.connectionAttempts == self.MAX_CONNECT_TRIES:
-                    raise e
-                else:
-                    self.connectionAttempts += 1
-                    time.sleep(self.WAIT_TIME)
-                    self.logger.info("Trying to connect once more %s/%s", self.connectionAttempts, self.MAX_CONNECT_TRIES)
+            except driver.Error as e:
+                self.logger.error("Could not contact the database : %s", self._describeError(e))
+                self.connection = None
+                self.connectionAttempts += 1
+                if self.connectionAttempts >= self.MAX_CONNECT_TRIES:
+                    raise
+                time.sleep(self.WAIT_TIME)
+                self.logger.info("Trying to connect once more %s/%s", self.connectionAttempts, self.MAX_CONNECT_TRIES)
 
+        self._configureConnection(self.connection)
+        self.statementCache.bind(self.connection)
         self.logger.debug("Connected to database")
 
-    def __close(self):
+    def _configureConnection(self, connection):
+        """Called on each new connection, before any action is executed"""
+        pass
+
+    def _close(self, force = False):
+        """Close the connection, unless it is kept between executions and force is False"""
+        if self.config.keepConnection() and not force:
+            return
         try:
-            if self.connection is not None and self.connectionAttempts == 0:
+            self.statementCache.bind(None)
+            if self.connection is not None:
                 self.connection.close()
                 self.logger.debug("Connection closed")
         except Exception as e:
             self.logger.warning("Error while closing the connection to the database : %s", e)
+        finally:
+            self.connection = None
+
+    def _describeError(self, error):
+        """Returns a printable description of a driver error"""
+        return error
+
+    class WriteBehind(Thread):
+        """Background writer of a Database
+        Waits for actions to arrive in a bounded queue and executes them in batches,
+        when flushSize actions are buffered or every flushInterval seconds
+
+        The connection retries and the database latency are only paid by this thread
+
+        """
+
+        DEFAULT_QUEUE_SIZE = 10000
+        DEFAULT_FLUSH_SIZE = 500
+        DEFAULT_FLUSH_INTERVAL = 30
+
+        def __init__(self, database, maxQueueSize = None, flushSize = None, flushInterval = None):
+            """Create a new writer
+
+            database - the Database whose actions are executed
+            maxQueueSize - number of actions waiting for the writer before put blocks
+            flushSize - number of buffered actions that triggers a flush
+            flushInterval - maximum time (in seconds) between two flushes
+
+            """
+            if maxQueueSize is None: maxQueueSize = self.DEFAULT_QUEUE_SIZE
+            if flushSize is None: flushSize = self.DEFAULT_FLUSH_SIZE
+            if flushInterval is None: flushInterval = self.DEFAULT_FLUSH_INTERVAL
+            Thread.__init__(self, name = "DatabaseWriter")
+            self.daemon = True
+            self.database = database
+            self.flushSize = flushSize
+            self.flushInterval = flushInterval
+            self.queue = Queue(maxQueueSize)
+
+        def put(self, action, timeout = None):
+            """Queue an action, blocks at most timeout seconds (forever if None) when the queue is full
+            raises Queue.Full if the action could not be queued in time
+
+            """
+            self.queue.put(action, True, timeout)
+
+        def flush(self):
+            """Request a flush of the buffered actions, does not wait for it"""
+            self.queue.put(_FlushRequest())
+
+        def drain(self):
+            """Wait for all the actions queued so far to be executed"""
+            request = _FlushRequest()
+            self.queue.put(request)
+            request.done.wait()
+
+        def close(self):
+            """Execute the actions queued so far and close the connection, waits for it"""
+            request = _FlushRequest(close = True)
+            self.queue.put(request)
+            request.done.wait()
+
+        def terminate(self):
+            """Execute all pending actions and end the thread"""
+            self.queue.put(None)
+            self.join()
+
+        def run(self):
+            lastFlush = time.time()
+            while True:
+                try:
+                    item = self.queue.get(True, max(0, lastFlush + self.flushInterval - time.time()))
+                except Empty:
+                    item = False
+                if item is None:
+                    self.database._executeAll()
+                    self.database._close(force = True)
+                    break
+                if isinstance(item, _FlushRequest):
+                    self.database._executeAll()
+                    if item.close:
+                        self.database._close(force = True)
+                    lastFlush = time.time()
+                    item.done.set()
+                    continue
+                if item is not False:
+                    self.database.actions.append(item)
+                if len(self.database.actions) >= self.flushSize or time.time() >= lastFlush + self.flushInterval:
+                    self.database._executeAll()
+                    lastFlush = time.time()
 
 
     class Configuration(object):
-        """Configuration information for the mailer"""
+        """Configuration information for a DB-API 2.0 database"""
+
+        DEFAULT_STATEMENT_CACHE_SIZE = 50
+
+        def __init__(self,
+                     driver,
+                     connectArgs = None,
+                     connectKwargs = None,
+                     mock = False,
+                     logger = None,
+                     keepConnection = False,
+                     statementCacheSize = None):
+            """Creates a new Configuration
+
+            driver - name of the DB-API module (imported on first connection) or the module itself
+            connectArgs - positional arguments given to driver.connect
+            connectKwargs - keyword arguments given to driver.connect
+            mock - sould the actions actually be performed ?
+            logger - a Logger class for logging purposes
+            keepConnection - keep the connection (and its statement cache) open between executions
+            statementCacheSize - number of prepared statements kept per connection
+
+            """
+            if connectArgs is None: connectArgs = ()
+            if connectKwargs is None: connectKwargs = {}
+            if statementCacheSize is None: statementCacheSize = self.DEFAULT_STATEMENT_CACHE_SIZE
+            self.__keepConnection = keepConnection
+            self.__statementCacheSize = statementCacheSize
+            self.__driver = driver
+            self.__connectArgs = tuple(connectArgs)
+            self.__connectKwargs = connectKwargs
+            self.__mock = mock
+            if logger is None:
+                self.__logger = logging.getLogger()
+            else:
+                self.__logger = logger
+
+        def getDriver(self):
+            return importDriver(self.__driver)
+
+        def getConnectionParam(self):
+            return self.__connectArgs, self.__connectKwargs
+
+        def isMock(self):
+            return self.__mock
+
+        def getLogger(self):
+            return self.__logger
+
+        def keepConnection(self):
+            return self.__keepConnection
+
+        def getStatementCacheSize(self):
+            return self.__statementCacheSize
+
+
+class _FlushRequest(object):
+    """Marker queued to ask the writer thread for a flush (and to close the connection if close is True)"""
+
+    def __init__(self, close = False):
+        self.done = Event()
+        self.close = close
+
+
+class StatementCache(object):
+    """LRU cache of prepared statements (one cursor per statement) for a connection
+    A cached statement is parsed by the database the first time only
+
+    Hit and miss counters are kept for the whole life of the cache, across connections
+
+    """
+
+    def __init__(self, size):
+        """Create a new cache
+
+        size - maximum number of statements kept (0 disables the cache)
+
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._connection = None
+        self._cursors = OrderedDict()
+
+    def bind(self, connection):
+        """Use connection from now on, the statements prepared for the previous one are dropped"""
+        self.clear()
+        self._connection = connection
+
+    def clear(self):
+        for cursor in self._cursors.values():
+            self._closeCursor(cursor)
+        self._cursors.clear()
+
+    def cursor(self, statement):
+        """Returns the cursor prepared for statement"""
+        cursor = self._cursors.pop(statement, None)
+        if cursor is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            cursor = self._connection.cursor()
+            if hasattr(cursor, 'prepare'):
+                cursor.prepare(statement)
+            if self.size <= 0:
+                return cursor
+            if len(self._cursors) >= self.size:
+                self._closeCursor(self._cursors.popitem(last = False)[1])
+                self.evictions += 1
+        self._cursors[statement] = cursor
+        return cursor
+
+    def execute(self, statement, params = ()):
+        """Executes statement with params on its prepared cursor, returns the cursor"""
+        cursor = self.cursor(statement)
+        cursor.execute(statement, params)
+        return cursor
+
+    def executemany(self, statement, rows):
+        """Executes statement for all rows on its prepared cursor, returns the cursor"""
+        cursor = self.cursor(statement)
+        cursor.executemany(statement, rows)
+        return cursor
+
+    @property
+    def hitRate(self):
+        """Ratio of the lookups found in the cache"""
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def _closeCursor(self, cursor):
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+class BatchAction(object):
+    """Action executing a statement for many rows in chunks, each chunk is sent to the
+    database in a single round trip with executemany (array binding on oracle) and committed
+
+    The action commits by itself, Database.executeAll runs it outside of any transaction
+    Rows are consumed lazily, so the whole set never needs to be in memory
+    If a chunk fails, it is kept and sent again first when the action is executed again,
+    chunks already committed are never sent twice
+    If the rows themselves raise, the action can not be retried (retryable is False)
+
+    """
+
+    DEFAULT_CHUNK_SIZE = 1000
+    commits = True
+
+    def __init__(self, statement, rows, chunkSize = None, statementCache = None):
+        """Creates a new batch
+
+        statement - the statement (with bind variables) to execute
+        rows - iterable of rows (sequences or dicts of bind values)
+        chunkSize - number of rows sent (and committed) at once
+        statementCache - StatementCache of the connection, the statement is prepared each time if None
+
+        """
+        if chunkSize is None: chunkSize = self.DEFAULT_CHUNK_SIZE
+        assert chunkSize > 0, "chunkSize must be strictly positive"
+        self.statement = statement
+        self.chunkSize = chunkSize
+        self.rowCount = 0
+        self.elapsed = 0.0
+        self._rows = iter(rows)
+        self._pending = None
+        self._statementCache = statementCache
+        self.retryable = True
+
+    def __call__(self, connection, logger):
+        if self._statementCache is not None:
+            cursor = self._statementCache.cursor(self.statement)
+        else:
+            cursor = connection.cursor()
+        start = time.time()
+        try:
+            while True:
+                if self._pending is None:
+                    try:
+                        self._pending = list(itertools.islice(self._rows, self.chunkSize))
+                    except Exception:
+                        # the rest of the rows is lost, a retry would wrongly end the batch
+                        self.retryable = False
+                        raise
+                if len(self._pending) == 0:
+                    break
+                cursor.executemany(self.statement, self._pending)
+                connection.commit()
+                self.rowCount += len(self._pending)
+                self._pending = None
+        finally:
+            self.elapsed += time.time() - start
+            if self._statementCache is None:
+                cursor.close()
+        logger.info("Batch of %s rows written in %.3fs (%.0f rows/s)", self.rowCount, self.elapsed, self.rowsPerSecond)
+
+    @property
+    def rowsPerSecond(self):
+        """Throughput of the rows written so far"""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.rowCount / self.elapsed
+
+
+class Oracle(Database):
+    """Object that does query on a oracle database (through cx_Oracle)
+        Load the query (as a method) with addAction and execute with executeAll or executeOne
+
+    """
+
+    def __init__(self, config):
+        """Creates a new Oracle interface
+
+        config - configuration data, instance of Oracle.Configuration
+
+        """
+        assert isinstance(config, Oracle.Configuration)
+        Database.__init__(self, config)
+
+    def _describeError(self, error):
+        error, = error.args
+        return "%s, %s, %s" % (error.code, error.message, error.context)
+
+    def _configureConnection(self, connection):
+        # size the oracle client side statement cache like ours
+        connection.stmtcachesize = self.config.getStatementCacheSize()
+
+
+    class Configuration(Database.Configuration):
+        """Configuration information for an oracle database"""
 
         DEFAULT_DB_PORT = 1521
+        DRIVER = 'cx_Oracle'
 
         def __init__(self,
                      userName = None,
@@ -113,7 +714,9 @@ class Oracle(object):
                      port = None,
                      sid = None,
                      mock = False,
-                     logger = None):
+                     logger = None,
+                     keepConnection = False,
+                     statementCacheSize = None):
             """Creates a new Configuration
             
             userName - user name to connect to the db
@@ -123,6 +726,8 @@ class Oracle(object):
             sid - service ID of the oracle db
             mock - sould the actions actually be performed ?
             logger - a Logger class for logging purposes
+            keepConnection - keep the connection (and its statement cache) open between executions
+            statementCacheSize - number of prepared statements kept per connection
             
             """
             if (userName is None
@@ -133,27 +738,61 @@ class Oracle(object):
 
             if port is None:
                 port = self.DEFAULT_DB_PORT
+            Database.Configuration.__init__(self, self.DRIVER, mock = mock, logger = logger,
+                                            keepConnection = keepConnection, statementCacheSize = statementCacheSize)
             self.__port = port
             self.__userName = userName
             self.__sid = sid
             self.__password = password
             self.__hostName = hostName
-            self.__mock = mock
-            if logger is None:
-                self.__logger = logging.getLogger()
-            else:
-                self.__logger = logger
 
         def getDsn(self):
-            return cx_Oracle.makedsn(self.__hostName, self.__port, self.__sid)
+            return self.getDriver().makedsn(self.__hostName, self.__port, self.__sid)
 
         def getConnectionParam(self):
-            return self.__userName, self.__password, self.getDsn()
+            return (self.__userName, self.__password, self.getDsn()), {}
 
-        def isMock(self):
-            return self.__mock
 
-        def getLogger(self):
-            return self.__logger
+class Sqlite(Database):
+    """Object that does query on a sqlite database (through sqlite3)
+    Useful to run the persistence path on hosts without a database server
+
+    Before python 3.6, sqlite3 commits before any SAVEPOINT statement, savepoints are not used:
+    a failing action rolls back its whole transaction (the other actions are executed again)
+
+    """
+
+    SAVEPOINTS = sys.version_info >= (3, 6)
+
+    def __init__(self, config):
+        """Creates a new Sqlite interface
+
+        config - configuration data, instance of Sqlite.Configuration
 
+        """
+        assert isinstance(config, Sqlite.Configuration)
+        Database.__init__(self, config)
 
+
+    class Configuration(Database.Configuration):
+        """Configuration information for a sqlite database"""
+
+        DRIVER = 'sqlite3'
+
+        def __init__(self,
+                     database,
+                     mock = False,
+                     logger = None,
+                     keepConnection = False,
+                     statementCacheSize = None):
+            """Creates a new Configuration
+
+            database - path of the database file
+            mock - sould the actions actually be performed ?
+            logger - a Logger class for logging purposes
+            keepConnection - keep the connection (and its statement cache) open between executions
+            statementCacheSize - number of prepared statements kept per connection
+
+            """
+            Database.Configuration.__init__(self, self.DRIVER, (database,), mock = mock, logger = logger,
+                                            keepConnection = keepConnection, statementCacheSize = statementCacheSize)
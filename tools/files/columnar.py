@@ -0,0 +1,360 @@
+"""
+Module to write and read structured data in a binary columnar format (see definitions.SimpleColumnar)
+
+Typed columns are much smaller than text, strings (uid, machines...) are stored once in a dictionary
+The reader maps the file in memory, rows are decoded batch by batch from the map (with struct.unpack_from),
+whole columns are only decoded on demand (see ColumnarReader.column)
+
+"""
+
+__all__ = ['ColumnarWriter', 'ColumnarReader']
+
+from array import array
+from datetime import datetime, timedelta
+import itertools
+import math
+import mmap
+import struct
+import sys
+
+from definitions import SimpleColumnar, ObjectWriter, TupleWriter, ListWriter
+from definitions import ObjectContainer, TupleContainer, ListContainer
+
+_EPOCH = datetime(1970, 1, 1)
+_NONE_LENGTH = 0xFFFFFFFF
+_HEADER = struct.Struct('<4sHcHQ')
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+_UINT64 = struct.Struct('<Q')
+_BYTE_ORDERS = {'little': '<', 'big': '>'}
+
+
+def _arrayTypecode(candidates, size):
+    """Returns the first array typecode of candidates whose items have size bytes, None if there is none
+    (eg. 8 bytes integers on windows with python 2, values are then kept in lists)
+
+    """
+    for typecode in candidates:
+        try:
+            if array(typecode).itemsize == size:
+                return typecode
+        except ValueError:
+            # typecode not available ('q' before python 3.3)
+            pass
+    return None
+
+
+# struct format characters (standard sizes) and array typecodes of the stored values, by column type
+_STRUCT_CODES = {SimpleColumnar.INT: 'q', SimpleColumnar.FLOAT: 'd', SimpleColumnar.TIMESTAMP: 'd', SimpleColumnar.STRING: 'I'}
+_ARRAY_TYPECODES = {SimpleColumnar.INT: _arrayTypecode('qli', 8),
+                    SimpleColumnar.FLOAT: _arrayTypecode('d', 8),
+                    SimpleColumnar.TIMESTAMP: _arrayTypecode('d', 8),
+                    SimpleColumnar.STRING: _arrayTypecode('IL', 4)}
+
+
+def _padding(size):
+    return '\0' * (-size % SimpleColumnar.ALIGNMENT)
+
+
+def _newColumn(columnType):
+    typecode = _ARRAY_TYPECODES[columnType]
+    if typecode is None:
+        return []
+    return array(typecode)
+
+
+def _packColumn(column, columnType):
+    """Returns the bytes of the values of a column, in the native byte order"""
+    if isinstance(column, array):
+        return column.tostring()
+    return struct.pack('=%d%s' % (len(column), _STRUCT_CODES[columnType]), *column)
+
+
+def _toSeconds(value):
+    if value is None:
+        return float('nan')
+    if isinstance(value, datetime):
+        return (value - _EPOCH).total_seconds()
+    return float(value)
+
+
+def _toDatetime(seconds):
+    if math.isnan(seconds):
+        return None
+    return _EPOCH + timedelta(seconds = seconds)
+
+
+class ColumnarWriter(object):
+    """Write sets of data to a binary columnar file
+    fileObj - a file object (opened in binary mode)
+    container - an instance of a Writer object, converts the datas into rows in the order of the schema
+    schema - list of (column name, type) where type is one of SimpleColumnar.TYPES,
+        INT and FLOAT columns can not hold None (TIMESTAMP and STRING columns can)
+
+    Columns are kept in memory, the file is written by close()
+
+    """
+
+    def __init__(self, fileObj, container = None, schema = None):
+        if not isinstance(container, (ObjectWriter, TupleWriter, ListWriter)):
+            raise Exception("Given writer is not valid")
+        if not schema:
+            raise Exception("A schema is required")
+        for name, columnType in schema:
+            if columnType not in SimpleColumnar.TYPES:
+                raise Exception("Unknown type %s for column %s" % (columnType, name))
+        self._file = fileObj
+        self._ownedFile = None
+        self._container = container
+        self._schema = list(schema)
+        self._rowCount = 0
+        self._columns = []
+        self._dictionaries = []
+        for name, columnType in self._schema:
+            self._columns.append(_newColumn(columnType))
+            if columnType == SimpleColumnar.STRING:
+                self._dictionaries.append(({}, []))
+            else:
+                self._dictionaries.append(None)
+
+    @classmethod
+    def open(cls, path, container = None, schema = None):
+        """Create a writer on the file at path, the file is written and closed by close()"""
+        writer = cls(open(path, 'wb'), container, schema)
+        writer._ownedFile = writer._file
+        return writer
+
+    def writerow(self, data):
+        self.writerows([data])
+
+    def writerows(self, datas):
+        rows = self._container.writeRows(list(datas))
+        if len(rows) == 0:
+            return
+        for row in rows:
+            if len(row) != len(self._schema):
+                raise ValueError("A row has %s values, the schema has %s columns : %r" % (len(row), len(self._schema), row))
+        columns = zip(*rows)
+        # all the columns are converted before any is extended, a bad value leaves the file unchanged
+        converted = [self._convert(name, columnType, values) for (name, columnType), values in itertools.izip(self._schema, columns)]
+        for (name, columnType), column, values, dictionary in itertools.izip(self._schema, self._columns, converted, self._dictionaries):
+            if columnType == SimpleColumnar.STRING:
+                codes, distinct = dictionary
+                for value in set(values).difference(codes):
+                    codes[value] = len(distinct)
+                    distinct.append(value)
+                column.extend(map(codes.__getitem__, values))
+            else:
+                column.extend(values)
+        self._rowCount += len(rows)
+
+    @staticmethod
+    def _convert(name, columnType, values):
+        """Returns the values of a column as stored, raises a ValueError naming the column for a bad value"""
+        if columnType == SimpleColumnar.STRING:
+            return values
+        if columnType != SimpleColumnar.TIMESTAMP and None in values:
+            raise ValueError("Column %s (%s) can not hold None, only TIMESTAMP and STRING columns can" % (name, columnType))
+        try:
+            if columnType == SimpleColumnar.TIMESTAMP:
+                values = map(_toSeconds, values)
+            stored = _newColumn(columnType)
+            if isinstance(stored, array):
+                stored.extend(values)
+            else:
+                _packColumn(values, columnType)
+                stored = values
+            return stored
+        except (TypeError, ValueError, OverflowError, struct.error) as e:
+            raise ValueError("Bad value in column %s (%s) : %s" % (name, columnType, e))
+
+    def close(self):
+        """Write the file, close it if it was opened by the writer"""
+        f = self._file
+        f.write(_HEADER.pack(SimpleColumnar.MAGIC, SimpleColumnar.VERSION, _BYTE_ORDERS[sys.byteorder],
+                             len(self._schema), self._rowCount))
+        size = _HEADER.size
+        for name, columnType in self._schema:
+            if isinstance(name, unicode): name = name.encode('utf-8')
+            description = _UINT16.pack(len(name)) + name + columnType
+            f.write(description)
+            size += len(description)
+        f.write(_padding(size))
+        for (name, columnType), column, dictionary in itertools.izip(self._schema, self._columns, self._dictionaries):
+            if dictionary is not None:
+                self._writeSection(self._encodeDictionary(dictionary[1]))
+            self._writeSection(_packColumn(column, columnType))
+        if self._ownedFile is not None:
+            self._ownedFile.close()
+            self._ownedFile = None
+
+    def _writeSection(self, data):
+        self._file.write(_UINT64.pack(len(data)))
+        self._file.write(data)
+        self._file.write(_padding(len(data)))
+
+    @staticmethod
+    def _encodeDictionary(values):
+        parts = [_UINT32.pack(len(values))]
+        for value in values:
+            if value is None:
+                parts.append(_UINT32.pack(_NONE_LENGTH))
+                continue
+            if isinstance(value, unicode): value = value.encode('utf-8')
+            value = str(value)
+            parts.append(_UINT32.pack(len(value)))
+            parts.append(value)
+        return ''.join(parts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnarReader(object):
+    """Read a binary columnar file through a memory map
+
+    path - path of the file
+    container - a TupleContainer, ListContainer or ObjectContainer, rows are fetched by batches
+
+    batches decodes only the rows of the current batch from the map, rawColumn and column decode
+    a whole column
+
+    """
+
+    DEFAULT_BATCH_SIZE = 10000
+
+    def __init__(self, path, container = None):
+        if container is not None and not isinstance(container, (ObjectContainer, TupleContainer, ListContainer)):
+            raise Exception("Given container is not valid")
+        self._container = container
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, byteOrder, columnCount, self._rowCount = _HEADER.unpack_from(self._map, 0)
+        if magic != SimpleColumnar.MAGIC or version != SimpleColumnar.VERSION:
+            raise Exception("%s is not a columnar file (version %s)" % (path, SimpleColumnar.VERSION))
+        self._byteOrder = byteOrder
+        self._swap = byteOrder != _BYTE_ORDERS[sys.byteorder]
+        offset = _HEADER.size
+        self._schema = []
+        for _ in range(columnCount):
+            nameLength, = _UINT16.unpack_from(self._map, offset)
+            offset += _UINT16.size
+            name = self._map[offset:offset + nameLength]
+            columnType = self._map[offset + nameLength]
+            offset += nameLength + 1
+            self._schema.append((name, columnType))
+        offset += -offset % SimpleColumnar.ALIGNMENT
+        # (dictionary section, data section) of each column, sections are (offset, length)
+        self._sections = {}
+        for name, columnType in self._schema:
+            dictionary = None
+            if columnType == SimpleColumnar.STRING:
+                dictionary, offset = self._section(offset)
+            data, offset = self._section(offset)
+            self._sections[name] = (dictionary, data)
+        self._dictionaries = {}
+
+    @property
+    def fieldnames(self):
+        return [name for name, columnType in self._schema]
+
+    @property
+    def schema(self):
+        return list(self._schema)
+
+    def __len__(self):
+        return self._rowCount
+
+    def rawColumn(self, name):
+        """Returns the stored values of a column : numbers (seconds for TIMESTAMP),
+        indexes in the dictionary for STRING (see dictionary)
+
+        """
+        columnType = dict(self._schema)[name]
+        typecode = _ARRAY_TYPECODES[columnType]
+        if typecode is None:
+            return list(self._values(name, 0, self._rowCount))
+        offset, length = self._sections[name][1]
+        values = array(typecode)
+        values.fromstring(buffer(self._map, offset, length))
+        if self._swap:
+            values.byteswap()
+        return values
+
+    def dictionary(self, name):
+        """Returns the distinct values of a STRING column"""
+        if not self._dictionaries.has_key(name):
+            offset, length = self._sections[name][0]
+            count, = _UINT32.unpack_from(self._map, offset)
+            offset += _UINT32.size
+            values = []
+            for _ in xrange(count):
+                valueLength, = _UINT32.unpack_from(self._map, offset)
+                offset += _UINT32.size
+                if valueLength == _NONE_LENGTH:
+                    values.append(None)
+                    continue
+                values.append(self._map[offset:offset + valueLength])
+                offset += valueLength
+            self._dictionaries[name] = values
+        return self._dictionaries[name]
+
+    def column(self, name):
+        """Returns the values of a column (strings decoded, datetimes for TIMESTAMP)"""
+        return self._decode(name, self.rawColumn(name))
+
+    def batches(self, batchSize = None):
+        """Generates the rows by batches of at most batchSize rows, fetched by the container
+        (tuples of values without container)
+
+        """
+        if batchSize is None:
+            batchSize = self.DEFAULT_BATCH_SIZE
+        for start in xrange(0, self._rowCount, batchSize):
+            count = min(batchSize, self._rowCount - start)
+            rows = zip(*[self._decode(name, self._values(name, start, count)) for name in self.fieldnames])
+            if self._container is None:
+                yield rows
+            else:
+                yield self._container.fetchBatch(rows, self.fieldnames)
+
+    def __iter__(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _section(self, offset):
+        """Returns the (offset, length) of the section at offset and the offset of the next one"""
+        length, = _UINT64.unpack_from(self._map, offset)
+        start = offset + _UINT64.size
+        end = start + length
+        return (start, length), end + (-end % SimpleColumnar.ALIGNMENT)
+
+    def _decode(self, name, raw):
+        """Returns the values of the column name from its stored values"""
+        columnType = dict(self._schema)[name]
+        if columnType == SimpleColumnar.STRING:
+            dictionary = self.dictionary(name)
+            return [dictionary[code] for code in raw]
+        if columnType == SimpleColumnar.TIMESTAMP:
+            return map(_toDatetime, raw)
+        return raw
+
+    def _values(self, name, start, count):
+        """Returns the stored values of count rows of a column from the row start, unpacked from the map"""
+        code = _STRUCT_CODES[dict(self._schema)[name]]
+        offset = self._sections[name][1][0] + start * struct.calcsize('=' + code)
+        return struct.unpack_from('%s%d%s' % (self._byteOrder, count, code), self._map, offset)
@@ -0,0 +1,87 @@
+"""
+Transparent compression of structured files
+
+gzip and bz2 are handled by the standard library, zstd requires the zstandard package
+(imported only when a zstd file is opened)
+
+The compression is detected by the extension of the file, or by its first bytes when reading
+
+"""
+
+__all__ = ['openFile', 'detectCompression', 'GZIP', 'BZIP2', 'ZSTD']
+
+import bz2
+import gzip
+import io
+import os
+
+GZIP = 'gzip'
+BZIP2 = 'bz2'
+ZSTD = 'zstd'
+
+EXTENSIONS = {'.gz': GZIP, '.gzip': GZIP, '.bz2': BZIP2, '.zst': ZSTD, '.zstd': ZSTD}
+MAGIC_BYTES = [('\x1f\x8b', GZIP), ('BZh', BZIP2), ('\x28\xb5\x2f\xfd', ZSTD)]
+DEFAULT_LEVELS = {GZIP: 6, BZIP2: 9, ZSTD: 3}
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+def detectCompression(path, mode = 'rb'):
+    """Returns the compression of the file (GZIP, BZIP2, ZSTD) or None if it is not compressed
+    by its extension, or by its first bytes when reading an existing file
+
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if EXTENSIONS.has_key(extension):
+        return EXTENSIONS[extension]
+    if 'r' in mode and os.path.isfile(path):
+        with open(path, 'rb') as f:
+            start = f.read(4)
+        for magic, compression in MAGIC_BYTES:
+            if start.startswith(magic):
+                return compression
+    return None
+
+
+def openFile(path, mode = 'rb', compression = None, level = None, bufferSize = None):
+    """Open a file, compressed or not, as a buffered stream
+    data is (de)compressed on the fly, there is no temporary file
+
+    path - path of the file
+    mode - 'rb', 'wb' or 'ab'
+    compression - GZIP, BZIP2, ZSTD, None to detect it (see detectCompression) or False for a plain file
+    level - compression level when writing (default depends on the compression, see DEFAULT_LEVELS)
+    bufferSize - size of the read buffer (writers buffer themselves, see StructuredWriter)
+
+    """
+    if bufferSize is None: bufferSize = DEFAULT_BUFFER_SIZE
+    if compression is None:
+        compression = detectCompression(path, mode)
+    if not compression:
+        return open(path, mode, bufferSize)
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+    reading = 'r' in mode
+    if compression == GZIP:
+        stream = gzip.GzipFile(path, mode, level)
+        # GzipFile.readline is slow, a buffered reader reads large blocks instead
+        if reading:
+            return io.BufferedReader(stream, bufferSize)
+        return stream
+    if compression == BZIP2:
+        if reading:
+            return bz2.BZ2File(path, mode, bufferSize)
+        return bz2.BZ2File(path, mode, bufferSize, level)
+    if compression == ZSTD:
+        return _openZstd(path, mode, level, bufferSize)
+    raise Exception("Unknown compression : %s" % compression)
+
+
+def _openZstd(path, mode, level, bufferSize):
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("The zstandard package is required for zstd files")
+    raw = open(path, mode)
+    if 'r' in mode:
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd = True), bufferSize)
+    return zstandard.ZstdCompressor(level = level).stream_writer(raw, closefd = True)
@@ -3,9 +3,12 @@ Definitions for reader and writer modules
 
 """
 import csv
+from datetime import date, datetime
+from operator import attrgetter
 
 __all__ = ['ListContainer', 'TupleContainer', 'ObjectContainer', 'FetchableObject',
-           'ListWriter', 'TupleWriter', 'ObjectWriter', 'WriteableObject']
+           'ListWriter', 'TupleWriter', 'ObjectWriter', 'WriteableObject', 'SimpleColumnar',
+           'parseDate', 'parseDatetime', 'autoConvert', 'inferSchema']
 
 
 class SimpleCsv(csv.excel):
@@ -32,12 +35,97 @@ class SimpleTsv(SimpleCsv):
 csv.register_dialect("simpletsv", SimpleTsv)
 
 
+class SimpleColumnar(object):
+    """Describe the binary columnar format (see the columnar module)
+
+    Header : MAGIC, VERSION, byte order, number of columns, number of rows,
+    then for each column its name and type
+    Columns follow one after the other, each one starting on an ALIGNMENT boundary:
+        INT and FLOAT columns are arrays of 8 bytes values
+        TIMESTAMP columns are FLOAT seconds since EPOCH (NaN for None)
+        STRING columns are dictionary encoded : the distinct values, then an array of 4 bytes indexes
+
+    """
+    MAGIC = 'PTCF'
+    VERSION = 1
+    ALIGNMENT = 8
+
+    INT = 'q'
+    FLOAT = 'd'
+    TIMESTAMP = 't'
+    STRING = 's'
+    TYPES = (INT, FLOAT, TIMESTAMP, STRING)
+
+
+def parseDate(value):
+    """Fast parser for %Y-%m-%d dates, returns a date"""
+    if len(value) != 10 or value[4] != '-' or value[7] != '-':
+        raise ValueError("Not a %%Y-%%m-%%d date : %s" % value)
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def parseDatetime(value):
+    """Fast parser for %Y-%m-%d %H:%M:%S dates, returns a datetime"""
+    if len(value) != 19 or value[4] != '-' or value[7] != '-' or value[10] != ' ' or value[13] != ':' or value[16] != ':':
+        raise ValueError("Not a %%Y-%%m-%%d %%H:%%M:%%S date : %s" % value)
+    return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+
+# types tried by inferSchema, strictest first
+INFERRED_TYPES = [int, float, parseDate, parseDatetime]
+
+
+def autoConvert(value):
+    """Converts value with the first of INFERRED_TYPES that accepts it, value is returned as is otherwise"""
+    for converter in INFERRED_TYPES:
+        try:
+            return converter(value)
+        except ValueError:
+            pass
+    return value
+
+
+def inferSchema(rows):
+    """Returns the constraints of the columns of rows : for each column the first of INFERRED_TYPES
+    converting all its values (empty values are ignored), str otherwise
+
+    """
+    width = max([len(row) for row in rows] or [0])
+    constraints = []
+    for i in range(width):
+        values = [row[i] for row in rows if i < len(row) and row[i] != '']
+        constraint = str
+        for converter in INFERRED_TYPES:
+            try:
+                for value in values:
+                    converter(value)
+            except ValueError:
+                continue
+            if len(values) > 0:
+                constraint = converter
+            break
+        constraints.append(constraint)
+    return constraints
+
+
+def _definingClass(cls, name):
+    """Returns the class of the mro of cls defining the attribute name"""
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass
+    return None
+
+
 class Writer(object):
-    """Datas for writing datas to files"""
+    """Datas for writing datas to files
+    writeRow and writeRows convert the datas without calling write, unless a subclass overrides write
+
+    """
 
     def __init__(self, columns = None):
         if columns is None: columns = []
         self._columns = columns
+        self._customWrite = _definingClass(type(self), 'write') not in (Writer, ObjectWriter, TupleWriter)
 
     @property
     def columns(self):
@@ -46,6 +134,14 @@ class Writer(object):
     def write(self, row):
         return row
 
+    def writeRow(self, data):
+        """Converts data into a sequence of values, in the order of the columns"""
+        return self.write(data)
+
+    def writeRows(self, datas):
+        """Converts a batch of datas into sequences of values, in the order of the columns"""
+        return map(self.writeRow, datas)
+
 
 class ObjectWriter(Writer):
     """Write object to files"""
@@ -58,6 +154,12 @@ class ObjectWriter(Writer):
         self._objectClass = objectClass
         self._mappings = mappings
         Writer.__init__(self, self.mappings.values())
+        # attributes in the order of the columns
+        getter = attrgetter(*self.mappings.keys()) if len(self.mappings) > 0 else lambda obj: ()
+        if len(self.mappings) == 1:
+            self._getter = lambda obj: (getter(obj),)
+        else:
+            self._getter = getter
 
     @property
     def mappings(self):
@@ -70,6 +172,17 @@ class ObjectWriter(Writer):
 
         return ret
 
+    def writeRow(self, obj):
+        if self._customWrite:
+            row = self.write(obj)
+            return [row.get(column, '') for column in self.columns]
+        return self._getter(obj)
+
+    def writeRows(self, objs):
+        if self._customWrite:
+            return map(self.writeRow, objs)
+        return map(self._getter, objs)
+
 
 class TupleWriter(Writer):
     """Write a tuple to a file"""
@@ -77,10 +190,29 @@ class TupleWriter(Writer):
     def write(self, data):
         return list(data)
 
+    def writeRow(self, data):
+        if self._customWrite:
+            return self.write(data)
+        return data
+
+    def writeRows(self, datas):
+        if self._customWrite:
+            return map(self.write, datas)
+        return datas
+
 
 class ListWriter(Writer):
     """Write list to file"""
-    pass
+
+    def writeRow(self, data):
+        if self._customWrite:
+            return self.write(data)
+        return data
+
+    def writeRows(self, datas):
+        if self._customWrite:
+            return map(self.write, datas)
+        return datas
 
 
 class WriteableObject(object):
@@ -102,6 +234,12 @@ class FetchableObject(object):
         return True
 
 
+def _compileConverter(lines, namespace):
+    """Compiles the source lines of a convert(row) function with the given global names"""
+    exec ("\n".join(lines), namespace)
+    return namespace['convert']
+
+
 class Container(object):
     pass
 
@@ -117,10 +255,21 @@ class ObjectContainer(Container):
         """
         if mappings is None : mappings = {}
         assert issubclass(objectClass, FetchableObject), "Object must implement FetchableObject"
-        if not objectClass().check(mappings):
-            raise Exception("Object does not have the required methods")
+        for method in mappings.keys():
+            if not hasattr(objectClass, method):
+                raise Exception("Object does not have the required methods")
         self._objectClass = objectClass
         self._mappings = mappings
+        self._converters = {}
+
+    def __getstate__(self):
+        # generated converters can not be pickled (ParallelReader), they are generated again when needed
+        state = self.__dict__.copy()
+        state['_converters'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
     @property
     def object(self):
@@ -131,38 +280,186 @@ class ObjectContainer(Container):
         return self._mappings
 
     def fetch(self, d):
-        """Fetches data from a row into a object"""
-        obj = self.object
-        # fill the objects with values
-        for method, args in self.mappings.iteritems():
-            try:
-                getattr(obj, method)(*[d[arg] for arg in args])
-            except KeyError:
-                raise Exception("Object mappings are wrong, column names not found in file")
-        return obj
+        """Fetches data from a row (dict) into a object"""
+        try:
+            return self.compile()(d)
+        except KeyError:
+            raise Exception("Object mappings are wrong, column names not found in file")
+
+    def fetchBatch(self, rows, fieldnames):
+        """Fetches a batch of rows (lists of values, not dicts) into objects
+
+        rows - list of rows
+        fieldnames - names of the columns of the rows
+
+        """
+        try:
+            return map(self.compile(fieldnames), rows)
+        except IndexError:
+            raise Exception("A row has fewer columns than the header")
+
+    def compile(self, fieldnames = None):
+        """Returns a function converting a row into an object
+        the function is generated once, with the methods and column positions resolved
+
+        fieldnames - names of the columns when the rows are lists of values, None when the rows are dicts
+
+        """
+        key = None
+        if fieldnames is not None:
+            key = tuple(fieldnames)
+        convert = self._converters.get(key)
+        if convert is not None:
+            return convert
+        if fieldnames is not None:
+            position = dict((name, i) for i, name in enumerate(fieldnames))
+        namespace = {'objectClass': self._objectClass}
+        lines = ["def convert(row):",
+                 "    obj = objectClass()"]
+        for num, (method, args) in enumerate(self.mappings.iteritems()):
+            namespace['method%d' % num] = getattr(self._objectClass, method)
+            if fieldnames is None:
+                values = ["row[%r]" % arg for arg in args]
+            else:
+                try:
+                    values = ["row[%d]" % position[arg] for arg in args]
+                except KeyError:
+                    raise Exception("Object mappings are wrong, column names not found in file")
+            lines.append("    method%d(%s)" % (num, ", ".join(["obj"] + values)))
+        lines.append("    return obj")
+        convert = _compileConverter(lines, namespace)
+        self._converters[key] = convert
+        return convert
 
 
 class ConstrainedContainer(Container):
-    """Apply constraints on given rows"""
+    """Apply constraints on given rows
+    Rows are converted by functions generated once per row length (see compile)
 
-    def __init__(self, constraintList = None):
-        """Define given constraints in the order given"""
+    Constraints can be inferred from the first rows read (see inferSchema), a row that does not
+    match the inferred types is then converted value by value with autoConvert
+    """
+
+    ROW_TYPE = list
+    DEFAULT_SAMPLE_SIZE = 100
+
+    def __init__(self, constraintList = None, inferSchema = False, sampleSize = None):
+        """Define given constraints in the order given
+
+        constraintList - callables converting the values of each column
+        inferSchema - if True and there is no constraintList, constraints are inferred by the readers
+        sampleSize - number of rows used to infer the constraints
+
+        """
+        if sampleSize is None: sampleSize = self.DEFAULT_SAMPLE_SIZE
         self._constaints = constraintList
+        self._converters = {}
+        self._inferSchema = inferSchema and constraintList is None
+        self._inferred = False
+        self.sampleSize = sampleSize
+
+    def __getstate__(self):
+        # generated converters can not be pickled (ParallelReader), they are generated again when needed
+        state = self.__dict__.copy()
+        state['_converters'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
     @property
     def constraints(self):
         return self._constaints
 
+    @property
+    def needsInference(self):
+        """Whether the readers must give a sample of rows to infer before fetching"""
+        return self._inferSchema and not self._inferred
+
+    def infer(self, rows):
+        """Sets the constraints from the given sample of rows"""
+        self._constaints = inferSchema(rows)
+        self._converters = {}
+        self._inferred = True
+
     def fetch(self, datas):
         if self.constraints is None:
             return datas
-        for i in range(0, len(datas)):
-            try:
-                datas[i] = self.constraints[i](datas[i])
-            except ValueError as e:
+        convert = self._converters.get(len(datas))
+        if convert is None:
+            convert = self.compile(len(datas))
+        try:
+            return convert(datas)
+        except ValueError as e:
+            if not self._inferred:
                 raise Exception("Type conversion impossible : %s" % e)
+            return self.ROW_TYPE([self._convertValue(i, value) for i, value in enumerate(datas)])
 
-        return datas
+    def _convertValue(self, i, value):
+        """Converts a value of the column i, falling back on autoConvert if the inferred type does not match"""
+        if i >= len(self.constraints):
+            return value
+        try:
+            return self.constraints[i](value)
+        except ValueError:
+            return autoConvert(value)
+
+    def compile(self, width):
+        """Returns a function converting a row of width values into a ROW_TYPE, applying the constraints
+        values without constraint are kept as is
+
+        """
+        constraints = self.constraints or []
+        namespace = {}
+        cells = []
+        for i in range(width):
+            if i < len(constraints):
+                namespace['constraint%d' % i] = constraints[i]
+                cells.append("constraint%d(row[%d])" % (i, i))
+            else:
+                cells.append("row[%d]" % i)
+        if self.ROW_TYPE is tuple:
+            values = "(%s)" % "".join(cell + ", " for cell in cells)
+        else:
+            values = "[%s]" % ", ".join(cells)
+        convert = _compileConverter(["def convert(row):",
+                                     "    return %s" % values], namespace)
+        self._converters[width] = convert
+        return convert
+
+    def fetchColumns(self, rows):
+        """Fetches a batch of rows into columns (one list per column)
+        constraints are applied on whole columns at once
+        all the rows of the batch must have the same number of values
+
+        """
+        if len(rows) == 0:
+            return []
+        width = len(rows[0])
+        for row in rows:
+            if len(row) != width:
+                raise Exception("Rows of a batch must have the same length")
+        columns = [list(column) for column in zip(*rows)]
+        if self.constraints is None:
+            return columns
+        for i, constraint in enumerate(self.constraints[:width]):
+            try:
+                columns[i] = map(constraint, columns[i])
+            except ValueError as e:
+                if not self._inferred:
+                    raise Exception("Type conversion impossible : %s" % e)
+                columns[i] = [self._convertValue(i, value) for value in columns[i]]
+        return columns
+
+    def _fetchRows(self, rows):
+        """Returns the rows of the batch as tuples, converted column by column when possible"""
+        if len(rows) == 0:
+            return []
+        width = len(rows[0])
+        for row in rows:
+            if len(row) != width:
+                return [tuple(self.fetch(row)) for row in rows]
+        return zip(*self.fetchColumns(rows))
 
 
 class ListContainer(ConstrainedContainer):
@@ -171,10 +468,22 @@ class ListContainer(ConstrainedContainer):
     def fetch(self, data):
         return ConstrainedContainer.fetch(self, data)
 
+    def fetchBatch(self, rows, fieldnames = None):
+        """Fetches a batch of rows into a list of lists"""
+        return map(list, self._fetchRows(rows))
+
 
 class TupleContainer(ConstrainedContainer):
     """Fetch Data into a tuple"""
 
+    ROW_TYPE = tuple
+
     def fetch(self, data):
-        return tuple(ConstrainedContainer.fetch(self, data))
+        if self.constraints is None:
+            return tuple(data)
+        return ConstrainedContainer.fetch(self, data)
+
+    def fetchBatch(self, rows, fieldnames = None):
+        """Fetches a batch of rows into a list of tuples"""
+        return self._fetchRows(rows)
 
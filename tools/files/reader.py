@@ -8,15 +8,24 @@ See tests (in __main__) for more detailed examples
 
 """
 
-__all__ = ['TsvReader', 'CsvReader', 'StructuredReader']
+__all__ = ['TsvReader', 'CsvReader', 'StructuredReader', 'IndexedReader', 'ParallelReader']
 
 from csv import DictReader
+from array import array
+import cPickle
 import csv
+import itertools
+import mmap
+import multiprocessing
+import os
 
 from definitions import ObjectContainer, TupleContainer, ListContainer
+from compression import openFile
 
 
 class StructuredReader(object):
+    DEFAULT_BATCH_SIZE = 10000
+
     def __init__(self, filename, container = None, dialect = 'simplecsv'):
         self._container = None
         if isinstance(container, ObjectContainer):
@@ -27,19 +36,100 @@ class StructuredReader(object):
             self._reader = csv.reader(filename, dialect = dialect)
         else:
             raise Exception("Given container is not valid")
+        self._fetch = self._container.fetch
+        self._ownedFile = None
+        self._rows = None
 
-    def next(self):
-        # do not treat the header row
-        if self._reader.line_num == 0:
-            self._reader.next()
+    @classmethod
+    def open(cls, path, container = None, compression = None, *args, **kwargs):
+        """Create a reader on the file at path, decompressing it on the fly if needed
+        (see tools.files.compression.openFile), the file is closed by close()
 
-        row = self._reader.next()
-        return self._container.fetch(row)
+        """
+        fileObj = openFile(path, 'rb', compression)
+        try:
+            reader = cls(fileObj, container, *args, **kwargs)
+        except Exception:
+            fileObj.close()
+            raise
+        reader._ownedFile = fileObj
+        return reader
+
+    def close(self):
+        """Close the file if it was opened by the reader"""
+        if self._ownedFile is not None:
+            self._ownedFile.close()
+            self._ownedFile = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def next(self):
+        # DictReader reads the header by itself
+        if isinstance(self._container, ObjectContainer):
+            return self._fetch(self._reader.next())
+        if self._rows is None:
+            self._startRows()
+        return self._fetch(self._rows.next())
 
 
     def __iter__(self):
         return self
 
+    def batches(self, batchSize = None):
+        """Generates the remaining rows by batches (lists) of at most batchSize rows
+        each batch is parsed and fetched at once by the container (see fetchBatch)
+
+        """
+        if batchSize is None:
+            batchSize = self.DEFAULT_BATCH_SIZE
+        fieldnames, rows = self._rawRows()
+        while True:
+            batch = list(itertools.islice(rows, batchSize))
+            if len(batch) == 0:
+                break
+            yield self._container.fetchBatch(batch, fieldnames)
+
+    def columnBatches(self, batchSize = None):
+        """Generates the remaining rows by batches of columns (one list of values per column)
+        only for TupleContainer and ListContainer
+
+        """
+        if isinstance(self._container, ObjectContainer):
+            raise Exception("Column batches are not available for objects")
+        if batchSize is None:
+            batchSize = self.DEFAULT_BATCH_SIZE
+        fieldnames, rows = self._rawRows()
+        while True:
+            batch = list(itertools.islice(rows, batchSize))
+            if len(batch) == 0:
+                break
+            yield self._container.fetchColumns(batch)
+
+    def _rawRows(self):
+        """Returns the header and an iterator on the remaining rows as lists of values"""
+        if isinstance(self._container, ObjectContainer):
+            # reads the header if needed
+            fieldnames = self._reader.fieldnames
+            # blank lines are skipped, as DictReader does
+            return fieldnames, itertools.ifilter(None, self._reader.reader)
+        if self._rows is None:
+            self._startRows()
+        return None, self._rows
+
+    def _startRows(self):
+        """Skips the header row and blank lines, gives a sample of rows to the container if it infers its schema"""
+        if self._reader.line_num == 0:
+            self._reader.next()
+        self._rows = itertools.ifilter(None, self._reader)
+        if self._container.needsInference:
+            sample = list(itertools.islice(self._rows, self._container.sampleSize))
+            self._container.infer(sample)
+            self._rows = itertools.chain(sample, self._rows)
+
 
 class CsvReader(StructuredReader):
     def __init__(self, fileObj, container = None):
@@ -50,6 +140,263 @@ class TsvReader(StructuredReader):
     def __init__(self, fileObj, container = None):
         StructuredReader.__init__(self, fileObj, container, dialect = 'simpletsv')
 
+
+class IndexedReader(object):
+    """Random access to the rows of a structured file, through a memory map of the file
+
+    The index holds the offset of each row (and optionally the rows of each value of a key column),
+    it is saved next to the file (indexPath) and reused as long as the size and modification
+    time of the file do not change
+    Offsets are stored as doubles ('l' is 32 bits on windows), exact for files up to 2**53 bytes
+
+    Rows are numbered from 0, the header is not a row
+    Not thread safe : rows are parsed from the shared position of the map
+
+    """
+
+    INDEX_EXTENSION = ".idx"
+    INDEX_VERSION = 2
+    OFFSET_TYPECODE = 'd'
+
+    def __init__(self, path, container = None, dialect = 'simplecsv', keyColumn = None, indexPath = None):
+        """Open an indexed file
+
+        path - path of the file to read
+        container - a TupleContainer, ListContainer or ObjectContainer
+        dialect - format of the file (see csv module)
+        keyColumn - name or position of the column to index for lookup (None for no key index)
+        indexPath - path of the index file (default is path + INDEX_EXTENSION)
+
+        """
+        if not isinstance(container, (ObjectContainer, TupleContainer, ListContainer)):
+            raise Exception("Given container is not valid")
+        if indexPath is None:
+            indexPath = path + self.INDEX_EXTENSION
+        self._container = container
+        self._dialect = dialect
+        self._path = path
+        self._indexPath = indexPath
+        self._file = open(path, 'rb')
+        self._map = None
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        self._header = None
+        self._offsets = array(self.OFFSET_TYPECODE)
+        self._keyColumn = keyColumn
+        self._keys = None
+        if not self._loadIndex():
+            self._buildIndex()
+            self._saveIndex()
+        if not isinstance(container, ObjectContainer) and container.needsInference:
+            container.infer([self._parseAt(offset) for offset in self._offsets[:container.sampleSize]])
+
+    @property
+    def fieldnames(self):
+        return self._header
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, rowNum):
+        return self.getRow(rowNum)
+
+    def getRow(self, rowNum):
+        """Returns the row number rowNum, fetched by the container"""
+        return self._fetch(self._parseAt(self._offsets[rowNum]))
+
+    def lookup(self, key):
+        """Returns the rows whose key column equals key, fetched by the container"""
+        if self._keys is None:
+            raise Exception("No key column indexed")
+        return [self.getRow(rowNum) for rowNum in self._keys.get(key, [])]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _fetch(self, values):
+        if isinstance(self._container, ObjectContainer):
+            return self._container.fetch(dict(itertools.izip(self._header, values)))
+        return self._container.fetch(values)
+
+    def _parseAt(self, offset):
+        self._map.seek(int(offset))
+        return csv.reader(iter(self._map.readline, ''), dialect = self._dialect).next()
+
+    def _fileSignature(self):
+        stat = os.fstat(self._file.fileno())
+        return stat.st_size, stat.st_mtime
+
+    def _buildIndex(self):
+        self._offsets = array(self.OFFSET_TYPECODE)
+        self._keys = None
+        if self._map is None:
+            return
+        # offset of the end of the lines read so far by the csv reader (rows may span several lines)
+        position = [0]
+
+        def lines():
+            self._map.seek(0)
+            for line in iter(self._map.readline, ''):
+                position[0] += len(line)
+                yield line
+
+        reader = csv.reader(lines(), dialect = self._dialect)
+        try:
+            self._header = reader.next()
+        except StopIteration:
+            return
+        keyPosition = None
+        if self._keyColumn is not None:
+            self._keys = {}
+            keyPosition = self._keyColumn
+            if not isinstance(keyPosition, int):
+                keyPosition = self._header.index(keyPosition)
+        rowNum = 0
+        while True:
+            rowStart = position[0]
+            try:
+                row = reader.next()
+            except StopIteration:
+                break
+            self._offsets.append(rowStart)
+            if keyPosition is not None and keyPosition < len(row):
+                self._keys.setdefault(row[keyPosition], []).append(rowNum)
+            rowNum += 1
+
+    def _loadIndex(self):
+        """Loads the saved index, returns False if there is none or if it is outdated"""
+        try:
+            with open(self._indexPath, 'rb') as indexFile:
+                index = cPickle.load(indexFile)
+        except Exception:
+            return False
+        if (index.get('version') != self.INDEX_VERSION
+            or index.get('signature') != self._fileSignature()
+            or index.get('dialect') != self._dialect
+            or (self._keyColumn is not None and index.get('keyColumn') != self._keyColumn)):
+            return False
+        self._header = index['header']
+        self._offsets = array(self.OFFSET_TYPECODE)
+        self._offsets.fromstring(index['offsets'])
+        self._keyColumn = index['keyColumn']
+        self._keys = index['keys']
+        return True
+
+    def _saveIndex(self):
+        index = {'version': self.INDEX_VERSION,
+                 'signature': self._fileSignature(),
+                 'dialect': self._dialect,
+                 'header': self._header,
+                 'offsets': self._offsets.tostring(),
+                 'keyColumn': self._keyColumn,
+                 'keys': self._keys}
+        try:
+            with open(self._indexPath, 'wb') as indexFile:
+                cPickle.dump(index, indexFile, cPickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            # the index is only a cache, the file can still be read without it
+            pass
+
+class ParallelReader(object):
+    """Parse a structured file on a pool of processes
+
+    The file is split in byte ranges on line boundaries, each range is parsed by a process
+    and fetched as a batch by the container (see StructuredReader.batches)
+    Only for dialects without quoting (eg. simpletsv) : a row can not span several lines
+
+    The container and the objects it creates must be picklable (classes and constraints defined
+    at module level)
+
+    """
+
+    DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, path, container = None, dialect = 'simpletsv', processes = None, chunkSize = None, ordered = True):
+        """Prepare a parallel read
+
+        path - path of the file to read
+        container - a TupleContainer, ListContainer or ObjectContainer
+        dialect - format of the file, quoting must be csv.QUOTE_NONE
+        processes - number of processes (default is the number of cpus), 1 parses in this process
+        chunkSize - size (in bytes) of the ranges given to the processes
+        ordered - whether batches are generated in the order of the file
+
+        """
+        if not isinstance(container, (ObjectContainer, TupleContainer, ListContainer)):
+            raise Exception("Given container is not valid")
+        if csv.get_dialect(dialect).quoting != csv.QUOTE_NONE:
+            raise Exception("Parallel parsing requires a dialect without quoting")
+        if processes is None: processes = multiprocessing.cpu_count()
+        if chunkSize is None: chunkSize = self.DEFAULT_CHUNK_SIZE
+        self._path = path
+        self._container = container
+        self._dialect = dialect
+        self._processes = processes
+        self._chunkSize = chunkSize
+        self._ordered = ordered
+
+    def __iter__(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def batches(self):
+        """Generates the rows of the file by batches, one batch per byte range"""
+        fieldnames, ranges = self._split()
+        if not isinstance(self._container, ObjectContainer) and self._container.needsInference:
+            with open(self._path, 'rb') as f:
+                rows = csv.reader(f, dialect = self._dialect)
+                rows.next()
+                self._container.infer(list(itertools.islice(rows, self._container.sampleSize)))
+        tasks = [(self._path, start, end, self._dialect, self._container, fieldnames) for start, end in ranges]
+        if self._processes <= 1:
+            for task in tasks:
+                yield _parseRange(task)
+            return
+        pool = multiprocessing.Pool(self._processes)
+        try:
+            if self._ordered:
+                results = pool.imap(_parseRange, tasks)
+            else:
+                results = pool.imap_unordered(_parseRange, tasks)
+            for batch in results:
+                yield batch
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _split(self):
+        """Returns the header and the byte ranges of the rest of the file, cut after line ends"""
+        ranges = []
+        with open(self._path, 'rb') as f:
+            header = csv.reader([f.readline()], dialect = self._dialect).next()
+            size = os.fstat(f.fileno()).st_size
+            start = f.tell()
+            while start < size:
+                if start + self._chunkSize >= size:
+                    end = size
+                else:
+                    f.seek(start + self._chunkSize)
+                    f.readline()
+                    end = f.tell()
+                ranges.append((start, end))
+                start = end
+        return header, ranges
+
+
+def _parseRange(task):
+    """Parse a byte range of a file (in a worker process of ParallelReader)"""
+    path, start, end, dialect, container, fieldnames = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    rows = [row for row in csv.reader(data.splitlines(True), dialect = dialect) if len(row) > 0]
+    return container.fetchBatch(rows, fieldnames)
+
 # class Reader(object):
 # def __init__(self, filename, resultContainer = None):
 #         '''Create a new file reader
@@ -3,10 +3,12 @@ Module to write data to files in a orderly fashion
 
 """
 
-from csv import DictWriter
+from cStringIO import StringIO
 import csv
+import itertools
 
 from definitions import ObjectWriter, TupleWriter, ListWriter
+from compression import openFile
 
 
 __all__ = ['StructuredWriter', 'TsvWriter', 'CsvWriter']
@@ -17,45 +19,108 @@ class StructuredWriter(object):
     filename - a file object
     container - an instance of a Writer object
     dialect - format of the output (see csv module)
-    
+    bufferSize - if not None, rows are formatted in memory and written to the file in one call
+                 once bufferSize bytes are buffered, flush must be called after the last row
+
+    Rows are converted into sequences of values by the container (objects through a
+    precompiled attribute getter) and formatted by batches by writerows
+
     """
 
-    def __init__(self, filename, container = None, dialect = 'simplecsv'):
+    DEFAULT_BUFFER_SIZE = 1024 * 1024
+    BATCH_SIZE = 10000
+
+    def __init__(self, filename, container = None, dialect = 'simplecsv', bufferSize = None):
         self._container = None
         if isinstance(container, ObjectWriter):
             self._container = container
-            self._writer = DictWriter(filename, fieldnames = container.columns, dialect = dialect)
             self.fieldnames = None
         elif isinstance(container, TupleWriter) or isinstance(container, ListWriter):
             self._container = container
-            self._writer = csv.writer(filename, dialect = dialect)
             self.fieldnames = container.columns
         else:
             raise Exception("Given writer is not valid")
+        self._file = filename
+        self._bufferSize = bufferSize
+        self._buffer = None
+        if bufferSize is not None:
+            self._buffer = StringIO()
+            self._writer = csv.writer(self._buffer, dialect = dialect)
+        else:
+            self._writer = csv.writer(filename, dialect = dialect)
+        self._ownedFile = None
+
+    @classmethod
+    def open(cls, path, container = None, compression = None, level = None, mode = 'wb', *args, **kwargs):
+        """Create a buffered writer on the file at path, compressing it on the fly if needed
+        (see tools.files.compression.openFile), the file is flushed and closed by close()
+
+        compression - compression of the file, detected from the extension of path if None
+        level - compression level
+        mode - 'wb' or 'ab'
+
+        """
+        kwargs.setdefault('bufferSize', cls.DEFAULT_BUFFER_SIZE)
+        fileObj = openFile(path, mode, compression, level)
+        try:
+            writer = cls(fileObj, container, *args, **kwargs)
+        except Exception:
+            fileObj.close()
+            raise
+        writer._ownedFile = fileObj
+        return writer
+
+    def close(self):
+        """Flush the buffered rows and close the file if it was opened by the writer"""
+        self.flush()
+        if self._ownedFile is not None:
+            self._ownedFile.close()
+            self._ownedFile = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def writerows(self, datas):
-        for row in datas:
-            self.writerow(row)
+        datas = iter(datas)
+        while True:
+            batch = list(itertools.islice(datas, self.BATCH_SIZE))
+            if len(batch) == 0:
+                break
+            self._writer.writerows(self._container.writeRows(batch))
+            self._flushIfFull()
 
     def writerow(self, data):
-        self._writer.writerow(self._container.write(data))
+        self._writer.writerow(self._container.writeRow(data))
+        self._flushIfFull()
 
     def writeheader(self):
-        if not ('writeheader' in dir(self._writer)):
-            if len(self.fieldnames) > 0:
-                self._writer.writerow(self.fieldnames)
-        else:
-            self._writer.writeheader()
+        if len(self._container.columns) > 0:
+            self._writer.writerow(self._container.columns)
+            self._flushIfFull()
+
+    def flush(self):
+        """Writes the buffered rows to the file"""
+        if self._buffer is not None and self._buffer.tell() > 0:
+            self._file.write(self._buffer.getvalue())
+            self._buffer.seek(0)
+            self._buffer.truncate()
+
+    def _flushIfFull(self):
+        if self._buffer is not None and self._buffer.tell() >= self._bufferSize:
+            self.flush()
 
     def __iter__(self):
         return self
 
 
 class CsvWriter(StructuredWriter):
-    def __init__(self, fileObj, container = None):
-        StructuredWriter.__init__(self, fileObj, container, dialect = 'simplecsv')
+    def __init__(self, fileObj, container = None, bufferSize = None):
+        StructuredWriter.__init__(self, fileObj, container, dialect = 'simplecsv', bufferSize = bufferSize)
 
 
 class TsvWriter(StructuredWriter):
-    def __init__(self, fileObj, container = None):
-        StructuredWriter.__init__(self, fileObj, container, dialect = 'simpletsv')
+    def __init__(self, fileObj, container = None, bufferSize = None):
+        StructuredWriter.__init__(self, fileObj, container, dialect = 'simpletsv', bufferSize = bufferSize)
@@ -5,16 +5,25 @@ Provide convenient handlers for logging
 Current implementation is based on the logging module (Facade implementation)
 
 """
-__all__ = ['getLogger', 'getDefaultFormatter', 'addStdoutAndStdErr', 'addDailyRotatingHandler', 'addErrorLog', 'addBasicLog']
+__all__ = ['getLogger', 'getDefaultFormatter', 'addStdoutAndStdErr', 'addDailyRotatingHandler', 'addErrorLog', 'addBasicLog',
+           'AsyncHandler', 'addAsyncLogging', 'CachedTimeFormatter', 'JsonFormatter', 'RateLimitFilter', 'LevelGuard']
 
+from collections import OrderedDict
+import json
 import logging
 import logging.handlers
+from threading import Thread, Event, Lock
+from Queue import Queue, Empty, Full
+import time
 
 DEFAULT_LOG_FORMAT = '%(asctime)s : %(levelname)s\t: %(message)s '
 DEFAULT_LOG_DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
 
 defaultFormatter = None
 
+# arguments of these types can be formatted later, by another thread
+IMMUTABLE_TYPES = (str, unicode, int, long, float, bool, type(None))
+
 
 def getLogger(name = None):
     """get a logger by its name"""
@@ -25,10 +34,70 @@ def getDefaultFormatter():
     """Returns the default formatter"""
     global defaultFormatter
     if defaultFormatter is None:
-        defaultFormatter = logging.Formatter(DEFAULT_LOG_FORMAT, DEFAULT_LOG_DATE_FORMAT)
+        defaultFormatter = CachedTimeFormatter(DEFAULT_LOG_FORMAT, DEFAULT_LOG_DATE_FORMAT)
     return defaultFormatter
 
 
+class CachedTimeFormatter(logging.Formatter):
+    """Formatter calling strftime once per second instead of once per record
+    the date format must not show fractions of seconds (always the case for strftime formats)
+
+    """
+
+    def __init__(self, fmt = None, datefmt = None):
+        logging.Formatter.__init__(self, fmt, datefmt)
+        # (second, formatted time), replaced at once so it is safe between threads
+        self._cachedTime = (None, None)
+
+    def formatTime(self, record, datefmt = None):
+        if datefmt is None:
+            # default format shows the milliseconds, see logging.Formatter.formatTime
+            datefmt = self.datefmt
+            if datefmt is None:
+                return logging.Formatter.formatTime(self, record)
+        second = int(record.created)
+        cached = self._cachedTime
+        if cached[0] != second or datefmt is not self.datefmt:
+            formatted = time.strftime(datefmt, self.converter(record.created))
+            if datefmt is not self.datefmt:
+                return formatted
+            cached = (second, formatted)
+            self._cachedTime = cached
+        return cached[1]
+
+
+class JsonFormatter(CachedTimeFormatter):
+    """Formats the records as JSON lines : one object per record
+    {"time": ..., "level": ..., "logger": ..., "message": ...} and "exception" if any, plus the extra fields
+
+    """
+
+    DEFAULT_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+    def __init__(self, datefmt = None, fields = None):
+        """Create a new formatter
+        datefmt - strftime format of the time field (ISO 8601 by default)
+        fields - names of other attributes of the records to add (eg. threadName, process)
+
+        """
+        if datefmt is None: datefmt = self.DEFAULT_DATE_FORMAT
+        CachedTimeFormatter.__init__(self, None, datefmt)
+        self.fields = list(fields or [])
+
+    def format(self, record):
+        message = record.getMessage()
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+        document = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name, 'message': message}
+        for field in self.fields:
+            document[field] = getattr(record, field, None)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document['exception'] = record.exc_text
+        return json.dumps(document, separators = (',', ':'), default = repr)
+
+
 def addStdoutAndStdErr(outLevel = logging.INFO, logger = getLogger(), formatter = getDefaultFormatter()):
     """Adds printing to stdouts and stderrs"""
     import sys
@@ -79,3 +148,344 @@ def addErrorLog(filename, logger = getLogger(), formatter = getDefaultFormatter(
     fileLogErr.setFormatter(formatter)
     fileLogErr.setLevel(logging.ERROR)
     logger.addHandler(fileLogErr)
+
+
+def addAsyncLogging(logger = getLogger(), maxQueueSize = None, flushSize = None, flushInterval = None, dropPolicy = None):
+    """Moves the handlers of the logger behind an AsyncHandler : they are then run by its writer thread
+    Call it once the handlers are added (addBasicLog, addDailyRotatingHandler...), returns the AsyncHandler
+
+    """
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    asyncHandler = AsyncHandler(handlers, maxQueueSize, flushSize, flushInterval, dropPolicy)
+    logger.addHandler(asyncHandler)
+    return asyncHandler
+
+
+class _FlushRequest(object):
+    """Marker queued to ask the writer thread for a flush"""
+
+    def __init__(self):
+        self.done = Event()
+
+
+class _RecordQueue(Queue):
+    """Queue of an AsyncHandler : records and control markers (None, _FlushRequest)"""
+
+    def dropOldestRecord(self):
+        """Removes the oldest queued record, markers are never dropped
+        returns whether a record was removed
+
+        """
+        with self.mutex:
+            for index, item in enumerate(self.queue):
+                if item is not None and not isinstance(item, _FlushRequest):
+                    del self.queue[index]
+                    self.not_full.notify()
+                    return True
+        return False
+
+
+class AsyncHandler(logging.Handler):
+    """Handler queuing the records for a writer thread which runs the given handlers
+    The logging threads only format the message and queue the record, the I/O is done by the writer
+    which writes the records by batches (one write and one flush per batch for stream and file handlers)
+
+    When the queue is full, the dropPolicy decides :
+        BLOCK - wait for the writer
+        DROP_NEWEST - drop the record being logged
+        DROP_OLDEST - drop the oldest queued record (flush and close requests are never dropped,
+            the record being logged is dropped when the queue only holds them)
+    dropped counts the dropped records, enqueueTime/maxEnqueueTime measure the time spent by the logging threads
+
+    """
+
+    BLOCK = 'block'
+    DROP_NEWEST = 'newest'
+    DROP_OLDEST = 'oldest'
+
+    DEFAULT_QUEUE_SIZE = 10000
+    DEFAULT_FLUSH_SIZE = 200
+    DEFAULT_FLUSH_INTERVAL = 1
+
+    # handlers written by batches, others are called record by record
+    BATCHED_HANDLERS = (logging.StreamHandler, logging.FileHandler)
+
+    def __init__(self, handlers, maxQueueSize = None, flushSize = None, flushInterval = None, dropPolicy = None):
+        """Create a new handler and start its writer thread
+
+        handlers - handlers run by the writer thread
+        maxQueueSize - number of records waiting for the writer before the dropPolicy applies
+        flushSize - maximum number of records written in a batch
+        flushInterval - maximum time (in seconds) a record waits for its batch
+        dropPolicy - BLOCK, DROP_NEWEST (default) or DROP_OLDEST
+
+        """
+        if maxQueueSize is None: maxQueueSize = self.DEFAULT_QUEUE_SIZE
+        if flushSize is None: flushSize = self.DEFAULT_FLUSH_SIZE
+        if flushInterval is None: flushInterval = self.DEFAULT_FLUSH_INTERVAL
+        if dropPolicy is None: dropPolicy = self.DROP_NEWEST
+        if dropPolicy not in (self.BLOCK, self.DROP_NEWEST, self.DROP_OLDEST):
+            raise Exception("Unknown drop policy : %s" % dropPolicy)
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        self.dropPolicy = dropPolicy
+        self.queue = _RecordQueue(maxQueueSize)
+        self.enqueued = 0
+        self.dropped = 0
+        self.enqueueTime = 0.0
+        self.maxEnqueueTime = 0.0
+        self._writer = self.Writer(self)
+        self._writer.start()
+
+    @property
+    def averageEnqueueTime(self):
+        """Average time (in seconds) spent by the logging threads per record"""
+        if self.enqueued == 0:
+            return 0.0
+        return self.enqueueTime / self.enqueued
+
+    def prepare(self, record):
+        """Makes the record independent of the logging thread : the exception is converted to text
+        and the message formatted, unless its arguments are immutable (the writer thread formats it then)
+
+        """
+        args = record.args
+        if args and not (isinstance(args, tuple) and all([isinstance(arg, IMMUTABLE_TYPES) for arg in args])):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = getDefaultFormatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        # called under the handler lock, counters are safe
+        start = time.time()
+        try:
+            self._put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+        elapsed = time.time() - start
+        self.enqueueTime += elapsed
+        if elapsed > self.maxEnqueueTime:
+            self.maxEnqueueTime = elapsed
+
+    def _put(self, record):
+        if self.dropPolicy == self.BLOCK:
+            self.queue.put(record)
+            self.enqueued += 1
+            return
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+            return
+        except Full:
+            pass
+        if self.dropPolicy == self.DROP_OLDEST and self.queue.dropOldestRecord():
+            self.dropped += 1
+            try:
+                self.queue.put_nowait(record)
+                self.enqueued += 1
+                return
+            except Full:
+                pass
+        # DROP_NEWEST, or the queue only holds flush and close requests (or was filled by them meanwhile)
+        self.dropped += 1
+
+    def flush(self):
+        """Wait for all the records queued so far to be written"""
+        if not self._writer.is_alive():
+            return
+        request = _FlushRequest()
+        self.queue.put(request)
+        request.done.wait()
+
+    def close(self):
+        """Write all pending records, end the writer thread and close the handlers"""
+        if self._writer.is_alive():
+            self.queue.put(None)
+            self._writer.join()
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
+
+    class Writer(Thread):
+        """Writer thread of an AsyncHandler"""
+
+        def __init__(self, asyncHandler):
+            Thread.__init__(self, name = "AsyncLogWriter")
+            self.daemon = True
+            self.asyncHandler = asyncHandler
+
+        def run(self):
+            queue = self.asyncHandler.queue
+            batch = []
+            running = True
+            while running:
+                item = queue.get()
+                requests = []
+                # gather the records already queued, waiting at most flushInterval for a full batch
+                deadline = time.time() + self.asyncHandler.flushInterval
+                while True:
+                    if item is None:
+                        running = False
+                        break
+                    if isinstance(item, _FlushRequest):
+                        requests.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.asyncHandler.flushSize:
+                        break
+                    try:
+                        item = queue.get(True, max(0, deadline - time.time()))
+                    except Empty:
+                        break
+                if len(batch) > 0:
+                    for handler in self.asyncHandler.handlers:
+                        self.write(handler, batch)
+                    batch = []
+                for request in requests:
+                    request.done.set()
+
+        @staticmethod
+        def write(handler, records):
+            """Write the records with the handler, with a single write and flush for stream and file handlers"""
+            records = [record for record in records if record.levelno >= handler.level]
+            if len(records) == 0:
+                return
+            if type(handler) not in AsyncHandler.BATCHED_HANDLERS:
+                for record in records:
+                    handler.handle(record)
+                return
+            handler.acquire()
+            try:
+                # a record that can not be formatted (eg. wrong arguments) is reported alone
+                formatted = []
+                lines = []
+                for record in records:
+                    if not handler.filter(record):
+                        continue
+                    try:
+                        lines.append("%s\n" % handler.format(record))
+                    except Exception:
+                        handler.handleError(record)
+                        continue
+                    formatted.append(record)
+                if len(lines) == 0:
+                    return
+                try:
+                    data = "".join(lines)
+                    if handler.stream is None:
+                        # delayed file handler
+                        handler.stream = handler._open()
+                    handler.stream.write(data)
+                    handler.flush()
+                except UnicodeError:
+                    # mixed or unencodable messages, the handler knows how to write them one by one
+                    for record in formatted:
+                        handler.handle(record)
+                except Exception:
+                    handler.handleError(formatted[0])
+            finally:
+                handler.release()
+
+
+class RateLimitFilter(logging.Filter):
+    """Limits the number of records per logger and message template (the message before its arguments are applied)
+    with token buckets : rate records per second, up to burst records at once
+
+    The first record let through after some were dropped tells how many were suppressed
+    Records above maxLevel (warnings and errors by default) are never limited
+
+    Add it to a handler to limit all the records it receives, to a logger to limit the records logged with it
+
+    """
+
+    DEFAULT_RATE = 10
+    DEFAULT_BURST = 50
+    DEFAULT_MAX_KEYS = 10000
+
+    def __init__(self, rate = None, burst = None, maxLevel = logging.INFO, maxKeys = None):
+        """Create a new filter
+
+        rate - records per second allowed for each template
+        burst - records allowed at once for each template
+        maxLevel - records above this level are always allowed
+        maxKeys - number of templates followed, the least recently used are forgotten
+
+        """
+        if rate is None: rate = self.DEFAULT_RATE
+        if burst is None: burst = self.DEFAULT_BURST
+        if maxKeys is None: maxKeys = self.DEFAULT_MAX_KEYS
+        logging.Filter.__init__(self)
+        self.rate = float(rate)
+        self.burst = burst
+        self.maxLevel = maxLevel
+        self.maxKeys = maxKeys
+        self.suppressed = 0
+        # (logger name, template) -> [tokens, last update, suppressed records]
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def filter(self, record):
+        if record.levelno > self.maxLevel:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = [self.burst, record.created, 0]
+                if len(self._buckets) >= self.maxKeys:
+                    self._buckets.popitem(last = False)
+            self._buckets[key] = bucket
+            bucket[0] = min(self.burst, bucket[0] + (record.created - bucket[1]) * self.rate)
+            bucket[1] = record.created
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            suppressed = bucket[2]
+            bucket[2] = 0
+        if suppressed > 0:
+            record.msg = "%s (suppressed %d messages)" % (record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+
+class LevelGuard(object):
+    """Cached logger.isEnabledFor(level) for hot loops, checked again every checkEvery uses
+
+        debug = LevelGuard(logger)
+        for line in lines:
+            if debug:
+                logger.debug("Line : %s", line)
+
+    """
+
+    DEFAULT_CHECK_EVERY = 1000
+
+    def __init__(self, logger, level = logging.DEBUG, checkEvery = None):
+        if checkEvery is None: checkEvery = self.DEFAULT_CHECK_EVERY
+        self.logger = logger
+        self.level = level
+        self.checkEvery = checkEvery
+        self.refresh()
+
+    def refresh(self):
+        """Check the level of the logger now"""
+        self._enabled = self.logger.isEnabledFor(self.level)
+        self._uses = self.checkEvery
+
+    def __nonzero__(self):
+        self._uses -= 1
+        if self._uses <= 0:
+            self.refresh()
+        return self._enabled
+
+    __bool__ = __nonzero__
@@ -9,6 +9,8 @@ to the parent's fields
 __all__ = ['ServerData', 'TimeMonitoredUser']
 import datetime
 
+from tools.files.definitions import SimpleColumnar
+
 
 class BaseUser(object):
     def __init__(self, uid = 'NONE'):
@@ -150,6 +152,14 @@ class ServerData(object):
     usedLicenses and freeLicenses return the corresponding values for the server
     """
 
+    # columns of usageRows, to write snapshots with tools.files.columnar
+    USAGE_SCHEMA = [('host', SimpleColumnar.STRING),
+                    ('uid', SimpleColumnar.STRING),
+                    ('machine', SimpleColumnar.STRING),
+                    ('server', SimpleColumnar.STRING),
+                    ('usage', SimpleColumnar.FLOAT),
+                    ('lastUpdate', SimpleColumnar.TIMESTAMP)]
+
     def __init__(self, hostName):
         """Creates a new container
         hostname - hostname of the server (or ip address)
@@ -228,6 +238,15 @@ class ServerData(object):
             return self._userUsage[uid.upper()]
         return None
 
+    def usageRows(self):
+        """Returns one row per user of the last dump, suitable for Database.addBatch
+        (hostname, uid, machine, server, usage time in seconds, last update)
+        the rows are copied now, the batch may be written after the next dump
+        """
+        return [(self._hostName, user.getUid(), user.getMachine(), user.getServer(),
+                 user.getUsageTime().total_seconds(), user.getLastUpdate())
+                for user in self._userUsage.itervalues()]
+
     def resetUsage(self):
         self._userUsage = {}
 
@@ -0,0 +1,313 @@
+"""
+Incremental reading of the FLEXlm debug log
+
+FlexLogTailer follows the log by offset : each poll reads only what was appended since the last one,
+parses the license events (OUT, IN, DENIED...) and stores them in a FlexEventStore, a sqlite database
+(through tools.db) indexed by time, with the checkpoint of the tailer
+
+    store = FlexEventStore.open("flexlog.sqlite")
+    tailer = FlexLogTailer(logFilePath, store)
+    tailer.poll()
+    store.events(start, end, action = 'DENIED')
+
+"""
+
+__all__ = ['FlexLogTailer', 'FlexEventStore', 'FlexEvent']
+
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+import hashlib
+import json
+import logging
+import os
+import re
+
+from tools.db import Sqlite
+from tools.files.definitions import parseDatetime
+
+# 16:37:12 (telelogic) OUT: "DOORS" SBX035@VSDS-BIE-L0150
+# 16:38:02 (telelogic) DENIED: "DOORS" SBX114@vsds-bie-w0063  (Licensed number of users already reached. (-4,342))
+EVENT_PATTERN = re.compile(r'\s*(\d+):(\d+):(\d+) \(([\w.-]+)\) (OUT|IN|DENIED|QUEUED|DEQUEUED|UNSUPPORTED): "([^"]+)" (\S+?)@(\S+)(?:\s+\((.*)\))?\s*$')
+# 17:00:00 (lmgrd) TIMESTAMP 3/21/2011
+TIMESTAMP_PATTERN = re.compile(r'\s*\d+:\d+:\d+ \([\w.-]+\) TIMESTAMP (\d+)/(\d+)/(\d+)')
+
+FlexEvent = namedtuple('FlexEvent', ['time', 'action', 'feature', 'user', 'host', 'daemon', 'detail'])
+
+
+class FlexLogTailer(object):
+    """Follows a FLEXlm debug log and stores its events
+
+    The file is identified by its inode and a fingerprint of its first bytes :
+        - same inode and fingerprint : the reading goes on at the last offset
+        - the file starts like the previous file (mergeLastLogs prepended the saved log) : the reading goes on
+          at the offset reached in the previous file
+        - otherwise (rotation, new log after a restart) : the file is read from the start
+    Each file read from the start is a new generation of the log, events are identified by their generation
+    and the offset of their line, so events read twice are stored once (see FlexEventStore)
+    When the reading goes on in the previous file, the events of the abandoned generation are replaced
+
+    Lines only give the time of the events, the day is given by the TIMESTAMP lines and advanced when
+    the time goes back (midnight), it is the current day until the first TIMESTAMP line
+
+    """
+
+    FINGERPRINT_SIZE = 1024
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, path, store, name = None, logger = logging.getLogger()):
+        """Create a new tailer, resuming from its checkpoint in the store
+
+        path - path of the log file
+        store - FlexEventStore
+        name - name of the checkpoint (absolute path of the log by default)
+        logger - logger for general purposes
+
+        """
+        self.path = path
+        self.store = store
+        self.name = name or os.path.abspath(path)
+        self.logger = logger
+        self._state = store.loadCheckpoint(self.name) or self._newState()
+        # generation whose events must be deleted with the next save
+        self._abandoned = None
+
+    @staticmethod
+    def _newState(previous = None):
+        generation = 0 if previous is None else previous['generation'] + 1
+        return {'inode': None, 'offset': 0, 'fingerprint': None, 'fingerprintLength': 0,
+                'day': None, 'lastTime': None, 'previous': previous, 'generation': generation}
+
+    @property
+    def offset(self):
+        return self._state['offset']
+
+    def poll(self):
+        """Reads and stores the events appended since the last poll, returns the number of events read"""
+        try:
+            f = open(self.path, 'rb')
+        except IOError as e:
+            self.logger.warning("Could not open FLEXlm log %s : %s", self.path, e)
+            return 0
+        count = 0
+        with f:
+            stat = os.fstat(f.fileno())
+            head = f.read(self.FINGERPRINT_SIZE)
+            self._identify(stat, head)
+            f.seek(self._state['offset'])
+            rest = ''
+            while True:
+                chunk = f.read(self.READ_SIZE)
+                if len(chunk) == 0:
+                    break
+                chunk = rest + chunk
+                end = chunk.rfind('\n') + 1
+                # partial last line, read again on the next chunk or poll
+                rest = chunk[end:]
+                if end == 0:
+                    continue
+                saved = json.dumps(self._state)
+                events = self._parse(chunk[:end], self._state['offset'])
+                self._state['offset'] += end
+                self._updateFingerprint(head)
+                if not self.store.save(self.name, self._state, events, self._abandoned):
+                    # nothing was stored, read these lines again on the next poll
+                    self._state = json.loads(saved)
+                    self.logger.warning("Could not store the events of FLEXlm log %s", self.path)
+                    break
+                self._abandoned = None
+                count += len(events)
+        if count > 0:
+            self.logger.debug("%s events read from %s", count, self.path)
+        return count
+
+    def _identify(self, stat, head):
+        """Decides where to resume the reading of the file"""
+        state = self._state
+        if self._matches(state, stat, head, checkInode = True):
+            state['inode'] = stat.st_ino
+            return
+        previous = state['previous']
+        if previous is not None and self._matches(previous, stat, head):
+            self.logger.info("FLEXlm log %s was merged with the previous log, resuming at %s", self.path, previous['offset'])
+            # the lines read in the new log are now after the offset of the previous one
+            self._abandoned = state['generation']
+            self._state = previous
+            self._state['inode'] = stat.st_ino
+            return
+        self.logger.info("New FLEXlm log %s, reading from the start", self.path)
+        if state['offset'] > 0:
+            state['previous'] = None
+            self._state = self._newState(state)
+        self._state['inode'] = stat.st_ino
+
+    @staticmethod
+    def _matches(state, stat, head, checkInode = False):
+        """Returns whether the file starts like the file of the state, and is the same file if checkInode
+        (the merged log is another file than the previous one, inodes are 0 on windows)
+
+        """
+        if checkInode and state['inode'] and stat.st_ino and state['inode'] != stat.st_ino:
+            return False
+        if state['fingerprint'] is None:
+            return state['offset'] == 0
+        if stat.st_size < state['offset'] or len(head) < state['fingerprintLength']:
+            return False
+        return hashlib.sha1(head[:state['fingerprintLength']]).hexdigest() == state['fingerprint']
+
+    def _updateFingerprint(self, head):
+        length = min(len(head), self._state['offset'])
+        if length > self._state['fingerprintLength']:
+            self._state['fingerprint'] = hashlib.sha1(head[:length]).hexdigest()
+            self._state['fingerprintLength'] = length
+
+    def _parse(self, data, offset):
+        """Returns (offset, event) of the complete lines of data read at offset, updating the day of the log"""
+        state = self._state
+        day = date.today() if state['day'] is None else date(*state['day'])
+        lastTime = state['lastTime']
+        events = []
+        for line in data.split('\n')[:-1]:
+            lineOffset = offset
+            offset += len(line) + 1
+            match = EVENT_PATTERN.match(line)
+            if match is None:
+                stamp = TIMESTAMP_PATTERN.match(line)
+                if stamp is not None:
+                    month, dayOfMonth, year = map(int, stamp.groups())
+                    day = date(year, month, dayOfMonth)
+                    lastTime = None
+                continue
+            hour, minute, second = int(match.group(1)), int(match.group(2)), int(match.group(3))
+            seconds = hour * 3600 + minute * 60 + second
+            if lastTime is not None and seconds < lastTime:
+                day += timedelta(days = 1)
+            lastTime = seconds
+            events.append((lineOffset, FlexEvent(datetime.combine(day, time(hour, minute, second)), match.group(5), match.group(6),
+                                    match.group(7), match.group(8), match.group(4), match.group(9))))
+        state['day'] = (day.year, day.month, day.day)
+        state['lastTime'] = lastTime
+        return events
+
+
+class FlexEventStore(object):
+    """Store of FLEXlm events and tailer checkpoints in a sqlite database (see tools.db.Sqlite)
+
+    An event is identified by its log (checkpoint name), the generation of the log and the offset of its line,
+    a line read twice is stored once
+
+    """
+
+    SCHEMA = ["CREATE TABLE IF NOT EXISTS flex_events (log TEXT NOT NULL, generation INTEGER NOT NULL, "
+              "line_offset INTEGER NOT NULL, time TEXT NOT NULL, action TEXT NOT NULL, feature TEXT NOT NULL, "
+              "user TEXT NOT NULL, host TEXT NOT NULL, daemon TEXT NOT NULL, detail TEXT, "
+              "PRIMARY KEY (log, generation, line_offset))",
+              "CREATE INDEX IF NOT EXISTS flex_events_time ON flex_events (time)",
+              "CREATE INDEX IF NOT EXISTS flex_events_user ON flex_events (user, time)",
+              "CREATE TABLE IF NOT EXISTS flex_checkpoints (name TEXT PRIMARY KEY, state TEXT NOT NULL)"]
+    INSERT_EVENT = "INSERT OR IGNORE INTO flex_events (log, generation, line_offset, time, action, feature, user, host, daemon, detail) " \
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    DELETE_GENERATION = "DELETE FROM flex_events WHERE log = ? AND generation = ?"
+    SAVE_CHECKPOINT = "INSERT OR REPLACE INTO flex_checkpoints (name, state) VALUES (?, ?)"
+    LOAD_CHECKPOINT = "SELECT state FROM flex_checkpoints WHERE name = ?"
+
+    def __init__(self, database):
+        """Create a new store on a tools.db.Sqlite database, the tables are created if needed"""
+        assert isinstance(database, Sqlite)
+        self.database = database
+        for statement in self.SCHEMA:
+            self.database.addAction(_Statements([(statement, ())]))
+        self.database.executeAll()
+
+    @classmethod
+    def open(cls, path, logger = None):
+        """Create a store on the sqlite database at path, keeping its connection open"""
+        return cls(Sqlite(Sqlite.Configuration(path, logger = logger, keepConnection = True)))
+
+    def save(self, name, state, events, abandonedGeneration = None):
+        """Stores the events ((line offset, FlexEvent) of the current generation of the state) and the checkpoint
+        of a tailer in a single transaction, deleting the events of the abandoned generation if not None
+        returns whether they were stored
+
+        """
+        statements = []
+        if abandonedGeneration is not None:
+            statements.append((self.DELETE_GENERATION, (name, abandonedGeneration)))
+        if len(events) > 0:
+            generation = state['generation']
+            statements.append((self.INSERT_EVENT, [(name, generation, offset, str(event.time)) + tuple(event[1:])
+                                                   for offset, event in events]))
+        statements.append((self.SAVE_CHECKPOINT, (name, json.dumps(state))))
+        return self._run(_Statements(statements, many = [self.INSERT_EVENT])) is not None
+
+    def loadCheckpoint(self, name):
+        """Returns the checkpoint saved under name, None if there is none"""
+        rows = self._query(self.LOAD_CHECKPOINT, (name,))
+        if len(rows) == 0:
+            return None
+        return json.loads(rows[0][0])
+
+    def events(self, start = None, end = None, action = None, feature = None, user = None):
+        """Returns the events between start (included) and end (excluded) ordered by time
+        optionally only the events of an action (eg. 'DENIED'), a feature or a user
+
+        """
+        conditions = []
+        params = []
+        for condition, value in (("time >= ?", start), ("time < ?", end), ("action = ?", action),
+                                 ("feature = ?", feature), ("user = ?", user)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(str(value) if isinstance(value, datetime) else value)
+        statement = "SELECT time, action, feature, user, host, daemon, detail FROM flex_events"
+        if len(conditions) > 0:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " ORDER BY time, log, generation, line_offset"
+        return [FlexEvent(parseDatetime(str(row[0])), *row[1:]) for row in self._query(statement, params)]
+
+    def close(self):
+        self.database.close()
+
+    def _query(self, statement, params):
+        rows = self._run(_Statements([(statement, params)]))
+        if rows is None:
+            raise Exception("Query failed : %s" % statement)
+        return rows
+
+    def _run(self, action):
+        """Executes the action in its own transaction, returns the rows of its last statement
+        or None if it failed or was not committed (it is not retried later)
+
+        """
+        self.database.addAction(action)
+        self.database.executeAll()
+        # a failed action (or a failed commit) leaves it in the buffer or the dead letters
+        if self.database.discard(action) or not action.done:
+            return None
+        return action.rows
+
+
+class _Statements(object):
+    """Action executing statements in the transaction of Database.executeAll (it does not commit)
+    statements listed in many are executed with executemany, the rows of the last statement are kept in rows
+    done tells that the statements were executed, they are committed only if the action then left the buffer
+
+    """
+
+    def __init__(self, statements, many = ()):
+        self.statements = statements
+        self.many = many
+        self.rows = None
+        self.done = False
+
+    def __call__(self, connection, logger):
+        cursor = connection.cursor()
+        try:
+            for statement, params in self.statements:
+                if statement in self.many:
+                    cursor.executemany(statement, params)
+                else:
+                    cursor.execute(statement, tuple(params))
+            self.rows = cursor.fetchall()
+            self.done = True
+        finally:
+            cursor.close()
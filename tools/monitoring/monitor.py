@@ -9,12 +9,15 @@ __all__ = ['FlexLmManager']
 import os
 import re
 import logging
+import shutil
 from datetime import datetime
 import time
-from threading import Thread, Event, RLock
+from threading import Thread, Event, Lock
 
 from tools.system import Console
+from tools.logs import LevelGuard
 from containers import ServerData
+from snapshots import LoggerSnapshotSink
 
 
 class FlexLmManager(object):
@@ -29,6 +32,9 @@ class FlexLmManager(object):
     DEFAULT_FLEX_PORT = 19353
     flexlmExcludeGroup = "GROUP_DOORS_EXCLUDE"
     DEFAULT_FLEX_OPTFILE_EXT = ".opt"
+    DEFAULT_ALIVE_MAX_AGE = 60
+    # Users of DOORS:  (Total of 56 licenses issued;  Total of 39 licenses in use)
+    ALIVE_PATTERN = re.compile(r"Users of .*?Total of (\d+) licenses issued.*?Total of (\d+) licenses in use.*")
 
     def __init__(self,
                  config,
@@ -44,13 +50,22 @@ class FlexLmManager(object):
         assert os.path.isfile(self.config.flexPath), "FlexLM tools not found at " + self.config.flexPath
         self.lmRestartCommands = []
         self.hostMonitors = {}
-        snapshotLock = RLock()
+        # probes of isAlive being executed, by host
+        self._probes = {}
+        self._probesLock = Lock()
+        # time of the last reload or restart, the dumps before it do not tell if the server is alive
+        self._lastReload = 0
+        if self.config.statusCacheTtl and not Console.cacheEnabled():
+            Console.enableCache()
+        self.snapshotSink = self.config.snapshotSink
+        if self.snapshotSink is None:
+            self.snapshotSink = LoggerSnapshotSink(self.config.snapshotLogger)
         for shost in config.hostToMonitor:
             host = shost.upper()
             cmd = self.STAT_COMMAND_TEMPLATE.format(flexPath = self.config.flexPath, host = shost, featureName = self.config.featureName,
                                                     port = self.config.flexPort)
-            self.hostMonitors[host] = self.ServerMonitor(ServerData(host), cmd, self.config.featureName, self.config.logger, snapshotLock,
-                                                         self.config.snapshotLogger)
+            self.hostMonitors[host] = self.ServerMonitor(ServerData(host), cmd, self.config.featureName, self.config.logger,
+                                                         self.snapshotSink, self.config.statusCacheTtl)
             self.hostMonitors[host].start()
 
         self.lmRestartCommands.append(
@@ -67,6 +82,7 @@ class FlexLmManager(object):
         """Terminates the monitors (ends the worker threads)"""
         for monitor in self.hostMonitors.values():
             monitor.terminate()
+        self.snapshotSink.close()
         self.config.logger.info("FlexLmManager monitor terminated")
 
     def getAllServerData(self):
@@ -83,18 +99,61 @@ class FlexLmManager(object):
             return self.hostMonitors[h].data
         return None
 
-    def isAlive(self, shost):
+    def isAlive(self, shost, maxAge = None):
         """Checks whether the server shost is alive
         shost - address (string) of the server to test
+        maxAge - age (in seconds) of the last dump of a monitor of shost for it to be used instead of a probe,
+            0 to always probe (default is the aliveMaxAge of the configuration)
         
         Test is done by searching for the feature lines and seeing if total licens issued is greater than 0
+        Concurrent callers for the same host share a single probe
         """
+        if maxAge is None:
+            maxAge = self.config.aliveMaxAge
+        monitor = self.hostMonitors.get(shost.upper())
+        if monitor is not None and maxAge > 0:
+            collected, issued = monitor.lastStatus
+            if collected is not None and collected > self._lastReload and time.time() - collected <= maxAge:
+                if issued is None or issued <= 0:
+                    self.config.logger.warning("Last dump of %s has no license issued", shost)
+                    return False
+                return True
+        return self._sharedProbe(shost, maxAge <= 0)
+
+    def _sharedProbe(self, shost, fresh):
+        """Probes shost, or waits for the probe of another caller
+        the error of a failed probe is raised to all its callers, it does not mean the server is down
+
+        """
+        key = (shost.upper(), fresh)
+        with self._probesLock:
+            probe = self._probes.get(key)
+            leader = probe is None
+            if leader:
+                probe = self._probes[key] = _Probe()
+        if not leader:
+            probe.done.wait()
+            if probe.error is not None:
+                raise probe.error
+            return probe.alive
+        try:
+            probe.alive = self._probe(shost, fresh)
+            return probe.alive
+        except Exception as e:
+            probe.error = e
+            raise
+        finally:
+            with self._probesLock:
+                del self._probes[key]
+            probe.done.set()
+
+    def _probe(self, shost, fresh):
+        """Runs lmstat against shost, a fresh probe does not use the cached results of the console"""
         cmd = self.STAT_COMMAND_TEMPLATE.format(flexPath = self.config.flexPath, host = shost, featureName = self.config.featureName,
                                                 port = self.config.flexPort)
-        result = Console.sendCommand(cmd)
-        ok = re.compile(r"Users of .*?Total of (\d+) licenses issued.*?Total of (\d+) licenses in use.*")
-        for line in result.getResult().splitlines():
-            res = ok.match(line)
+        result = Console.sendCommand(cmd, cacheTtl = 0 if fresh else self.config.statusCacheTtl)
+        for line in result.getSplitResult():
+            res = self.ALIVE_PATTERN.match(line)
             if res is not None:
                 # there is a least one license issued
                 if int(res.group(1)) > 0:
@@ -119,6 +178,7 @@ class FlexLmManager(object):
         Failsafe : test if server is alive after 1 minute
         """
         self.config.logger.info("Reloading server")
+        self._lastReload = time.time()
         for command in self.lmRestartCommands:
             self.config.logger.debug("Sending command %s", command)
             if not self.config.mock:
@@ -130,13 +190,14 @@ class FlexLmManager(object):
                 else:
                     self.config.logger.info("Reload command successful : %s", command)
                 time.sleep(60)
-        if not self.isAlive(self.config.currentHost):
+        if not self.isAlive(self.config.currentHost, maxAge = 0):
             self.config.logger.warning("Server is not alive, restarting")
             self.restartServer()
 
     def restartServer(self):
         """Restart (service restart) the server, saving the logs and remerging them at the same time"""
         self.logSaver.backupLog()
+        self._lastReload = time.time()
         self.config.logger.info("Restarting server service...")
         stopResult = Console.sendCommand('net stop "%s"' % self.config.flexServiceName)
         if stopResult.hasErrors():
@@ -196,12 +257,14 @@ class FlexLmManager(object):
     class ServerMonitor(Thread):
         """Main worker, does the actual job of parsing the output and places it in a ServerData object"""
 
-        def __init__(self, oServer, statusCommand, featureName, logger, snapshotLock, snapshotLogger):
+        def __init__(self, oServer, statusCommand, featureName, logger, snapshotSink, statusCacheTtl = None):
             """Create a new Worker
             oServer - ServerData instance, where the information will be saved
             statusCommand - Command to send to get the status dump
             featureName - name of feature to monitor
             logger - logger instance
+            snapshotSink - sink of the relevant lines of the dumps (see tools.monitoring.snapshots)
+            statusCacheTtl - time (in seconds) the status dump is shared with the other callers (see Console.sendCommand)
             """
             Thread.__init__(self, name = "ServerMonitor-%s" % oServer.hostname)
             self._serverData = oServer
@@ -212,8 +275,10 @@ class FlexLmManager(object):
             self.isRunning = True
             self.logger = logger
             self._statusCommand = statusCommand
-            self._snapshotLock = snapshotLock
-            self._snapshotLogger = snapshotLogger
+            self._snapshotSink = snapshotSink
+            self._statusCacheTtl = statusCacheTtl
+            # (time of the last dump, licenses issued or None if the feature line was not found)
+            self._lastStatus = (None, None)
 
         def monitor(self):
             """Monitor the server once (gets the data)"""
@@ -250,16 +315,19 @@ class FlexLmManager(object):
                 r"Users of {featureName}.*?Total of (\d+) licenses issued.*?Total of (\d+) licenses in use.*".format(featureName = self._featureName))
             userDataPattern = re.compile(r"\s+([\w.-]+)\s+([\w-]+)\s+([\w-]+?)\s+([\w -]*)\(.+\)\s\(.+\), start \w+ (\d+/\d+\s\d+:\d+)\s*")
             featureLinePattern = re.compile(r"Users of\s.*")
+            debug = LevelGuard(self.logger)
             while self.isRunning:
                 self._monitorEvent.wait()
                 if not self.isRunning:
                     break
-                dumpLines = Console.sendCommand(self._statusCommand).getSplitResult()
+                dumpLines = Console.sendCommand(self._statusCommand, cacheTtl = self._statusCacheTtl).getSplitResult()
                 if len(dumpLines) <= 0:
                     self.logger.warning("No dump received for %s", self._statusCommand)
                     self._monitorEvent.clear()
                     continue
+                debug.refresh()
                 dumpDate = None
+                issued = None
                 feature = False
                 relevantLines = []
                 lineCounter = -1
@@ -267,12 +335,14 @@ class FlexLmManager(object):
                     lineCounter += 1
                     if not len(singleLine) > 0:
                         continue
-                    self.logger.debug(singleLine)
+                    if debug:
+                        self.logger.debug("Dump line : %s", singleLine)
                     # find date of dump generation
                     if dumpDate is None:
                         dateMatch = licDatePattern.match(singleLine)
                         if dateMatch is not None:
-                            self.logger.debug("License date matched for line : %s", singleLine)
+                            if debug:
+                                self.logger.debug("License date matched for line : %s", singleLine)
                             # construct the date
                             dumpDate = datetime.strptime(dateMatch.group(1), "%m/%d/%Y %H:%M")
                             relevantLines.append(lineCounter)
@@ -285,6 +355,7 @@ class FlexLmManager(object):
                             fMatch = totalPattern.match(singleLine)
                             if fMatch is not None:
                                 feature = True
+                                issued = int(fMatch.group(1))
                                 self._serverData.usedLicenses = fMatch.group(2)
                                 self._serverData.totalLicenses = fMatch.group(1)
                                 relevantLines.append(lineCounter)
@@ -303,14 +374,11 @@ class FlexLmManager(object):
                 self.logger.info("Total licenses read for host %s : %s/%s", self._serverData.hostname, self._serverData.usedLicenses,
                                  self._serverData.totalLicenses)
                 self._serverData.lastDump = dumpDate
+                self._lastStatus = (time.time(), issued)
                 self._monitorEvent.clear()
                 self.__resultCollected.set()
-                with self._snapshotLock:
-                    self._snapshotLogger.info("New dump from %s", self._serverData.hostname)
-                    for lineNum in relevantLines:
-                        self._snapshotLogger.info(dumpLines[lineNum])
-                    self._snapshotLogger.info("End of dump")
-                    # end while
+                self._snapshotSink.write(self._serverData.hostname, [dumpLines[lineNum] for lineNum in relevantLines])
+                # end while
 
         @property
         def data(self):
@@ -323,6 +391,11 @@ class FlexLmManager(object):
             """Get number of users found in the last dump"""
             return len(self._serverData.userUsage)
 
+        @property
+        def lastStatus(self):
+            """(time of the last dump, licenses issued in it or None), does not wait for a running collection"""
+            return self._lastStatus
+
     class Configuration(object):
         """Configuration Data for the FlexLmMonitor"""
 
@@ -337,7 +410,10 @@ class FlexLmManager(object):
                      flexServiceName = None,
                      logger = logging.getLogger(),
                      snapshotLogger = logging.getLogger(),
-                     mock = False):
+                     mock = False,
+                     snapshotSink = None,
+                     statusCacheTtl = None,
+                     aliveMaxAge = None):
             """Creates a new Configuration
             currentHost - host (string) on which the script is running (for restarts)
             hostToMonitors - array of address strings to monitor
@@ -350,6 +426,9 @@ class FlexLmManager(object):
             logger - logger for general purposes
             snapshotLogger - logger for the snapshots (copy the output)
             mock - should sensible operations be done (restarts...)
+            snapshotSink - sink of the dumps (eg. FileSnapshotSink), default writes them to the snapshotLogger
+            statusCacheTtl - time (in seconds) an lmstat dump is reused by isAlive and the monitors (not cached if None)
+            aliveMaxAge - age (in seconds) of the last dump of a monitor for isAlive to use it instead of a probe
             
             """
             if flexOptFileName is None:
@@ -358,6 +437,8 @@ class FlexLmManager(object):
                 flexPort = FlexLmManager.DEFAULT_FLEX_PORT
             if flexServiceName is None:
                 flexServiceName = FlexLmManager.DEFAULT_FLEX_SERVICENAME
+            if aliveMaxAge is None:
+                aliveMaxAge = FlexLmManager.DEFAULT_ALIVE_MAX_AGE
 
             self._currentHost = currentHost
             self._hostToMonitor = hostToMonitor
@@ -370,6 +451,9 @@ class FlexLmManager(object):
             self._logger = logger
             self._snapshotLogger = snapshotLogger
             self._mock = mock
+            self._snapshotSink = snapshotSink
+            self._statusCacheTtl = statusCacheTtl
+            self._aliveMaxAge = aliveMaxAge
 
         @property
         def vendor(self):
@@ -415,6 +499,53 @@ class FlexLmManager(object):
         def mock(self):
             return self._mock
 
+        @property
+        def snapshotSink(self):
+            return self._snapshotSink
+
+        @property
+        def statusCacheTtl(self):
+            return self._statusCacheTtl
+
+        @property
+        def aliveMaxAge(self):
+            return self._aliveMaxAge
+
+
+class _Probe(object):
+    """isAlive probe shared by concurrent callers"""
+
+    def __init__(self):
+        self.done = Event()
+        self.alive = False
+        # exception raised by the probe, raised again to the waiting callers
+        self.error = None
+
+
+def copyFileObj(source, target, bufferSize = None):
+    """Copy the rest of the source file to the target file in constant memory
+    with sendfile when available (linux, python 3), by blocks of bufferSize bytes otherwise
+
+    """
+    if bufferSize is None: bufferSize = LogSaver.COPY_BUFFER_SIZE
+    if hasattr(os, 'sendfile'):
+        try:
+            source.flush()
+            target.flush()
+            offset = source.tell()
+            while True:
+                sent = os.sendfile(target.fileno(), source.fileno(), offset, bufferSize)
+                if sent == 0:
+                    break
+                offset += sent
+            source.seek(offset)
+            target.seek(0, os.SEEK_END)
+            return
+        except OSError:
+            # sendfile does not handle all files (eg. before linux 2.6.33)
+            pass
+    shutil.copyfileobj(source, target, bufferSize)
+
 
 class LogSaver(object):
     """Backup and merge the given logs
@@ -422,11 +553,13 @@ class LogSaver(object):
     merge is done in place with the last log saved
     
     Root logger is used unless a logger is supplied with setLogger or as parameter
-    
-    NOTE:Works only in windows
+
+    Files are copied natively (see copyFileObj), in constant memory
     
     """
 
+    COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
     def __init__(self, logSaveDir, logFilePath, logger = logging.getLogger()):
         """Create a new logSaver
         logSaveDir - directory to save the backups
@@ -457,16 +590,22 @@ class LogSaver(object):
         now = datetime.now().strftime("%Y-%m-%d_%H_%M")
         filename = "log-%s.log" % now
         self.lastLogSave = os.path.join(self.logSaveDir, filename)
-        result = Console.sendCommand('copy /Y /B "%s" "%s" ' % (self.logFilePath, self.lastLogSave))
-        if result.hasErrors():
-            self.logger.warning("Error during log backup %s", result.getErrors())
+        try:
+            with open(self.logFilePath, 'rb') as source:
+                with open(self.lastLogSave, 'wb') as target:
+                    copyFileObj(source, target, self.COPY_BUFFER_SIZE)
+        except (IOError, OSError) as e:
+            self.logger.warning("Error during log backup %s", e)
         else:
             self.logger.info("Log save as %s" % self.lastLogSave)
 
     def mergeLastLogs(self):
         """Merges the lastSaveLog with the current logFile (prepends the last log), maintaining
         chronology of the logs
-        
+
+        The log file is rewritten in place (the server may keep it open), only its current content
+        is copied to a temporary file
+
         """
         # nothing to merge !
         if self.lastLogSave is None:
@@ -475,14 +614,27 @@ class LogSaver(object):
         self.logger.info("Merging logs")
         # temp filename
         tempLog = self.logFilePath + "s"
-        # send the copy command
-        result = Console.sendCommand('copy /Y /B "%s" "%s" && copy /Y /B "%s"+"%s" "%s" && del "%s"' % (self.logFilePath,
-                                                                                                        tempLog,
-                                                                                                        self.lastLogSave,
-                                                                                                        tempLog,
-                                                                                                        self.logFilePath,
-                                                                                                        tempLog))
-        if result.hasErrors():
-            self.logger.warning("Error while merging logs : %s", result.getErrors())
+        try:
+            # the saved log is opened first, the log is not touched if it can not be read
+            with open(self.lastLogSave, 'rb') as lastLog:
+                with open(self.logFilePath, 'r+b') as log:
+                    with open(tempLog, 'w+b') as temp:
+                        copyFileObj(log, temp, self.COPY_BUFFER_SIZE)
+                        log.seek(0)
+                        log.truncate()
+                        try:
+                            copyFileObj(lastLog, log, self.COPY_BUFFER_SIZE)
+                            temp.seek(0)
+                            copyFileObj(temp, log, self.COPY_BUFFER_SIZE)
+                        except (IOError, OSError):
+                            # put the current log back
+                            log.seek(0)
+                            log.truncate()
+                            temp.seek(0)
+                            copyFileObj(temp, log, self.COPY_BUFFER_SIZE)
+                            raise
+            os.remove(tempLog)
+        except (IOError, OSError) as e:
+            self.logger.warning("Error while merging logs : %s", e)
         else:
             self.logger.info("Logs merged successfully")
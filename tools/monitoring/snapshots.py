@@ -0,0 +1,154 @@
+"""
+Sinks for the snapshots of the FlexLm dumps (relevant lines of each dump)
+
+Each dump is written as one pre-formatted block, the monitors of different hosts never wait for each other :
+    LoggerSnapshotSink - one logging record per dump (legacy behaviour of the snapshotLogger)
+    FileSnapshotSink - one append file per host, optionally compressed and rotated by size
+
+"""
+
+__all__ = ['LoggerSnapshotSink', 'FileSnapshotSink']
+
+from datetime import datetime
+import logging
+import os
+from threading import Lock
+
+from tools.files.compression import openFile, GZIP, BZIP2, ZSTD
+
+SNAPSHOT_DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+
+def formatSnapshot(hostname, lines):
+    """Returns the block of a dump : a header line, the lines and an end line"""
+    block = ["New dump from %s\n" % hostname]
+    block.extend(["%s\n" % line for line in lines])
+    block.append("End of dump\n")
+    return "".join(block)
+
+
+class LoggerSnapshotSink(object):
+    """Writes each dump as a single record of a logger"""
+
+    def __init__(self, logger = logging.getLogger()):
+        self.logger = logger
+
+    def write(self, hostname, lines):
+        """Write the lines of a dump of the host"""
+        self.logger.info(formatSnapshot(hostname, lines).rstrip("\n"))
+
+    def close(self):
+        pass
+
+
+class FileSnapshotSink(object):
+    """Appends the dumps of each host to its own file : hosts are only serialized by their own lock
+
+    Plain files are kept open, compressed files get one complete member (gzip) or frame (zstd) per dump :
+    a crash never leaves an unterminated member that would hide the next dumps
+    A file is rotated (file.1, file.2...) once its size on disk reaches maxBytes
+
+    """
+
+    DEFAULT_FILENAME_TEMPLATE = "snapshot-{host}.log"
+    DEFAULT_BACKUP_COUNT = 7
+    EXTENSIONS = {GZIP: '.gz', ZSTD: '.zst'}
+
+    def __init__(self, directory, compression = None, maxBytes = None, backupCount = None, filenameTemplate = None):
+        """Create a new sink
+
+        directory - directory of the snapshot files (created if needed)
+        compression - None, GZIP or ZSTD (compressed files are appended as new members/frames)
+        maxBytes - size on disk (compressed size) of a file before it is rotated, None to never rotate
+        backupCount - number of rotated files kept
+        filenameTemplate - name of the file of a host ({host} is replaced by the hostname), the extension
+            of the compression is appended
+
+        """
+        if backupCount is None: backupCount = self.DEFAULT_BACKUP_COUNT
+        if filenameTemplate is None: filenameTemplate = self.DEFAULT_FILENAME_TEMPLATE
+        if compression == BZIP2:
+            raise Exception("bz2 files can not be appended, use %s or %s" % (GZIP, ZSTD))
+        if compression and not self.EXTENSIONS.has_key(compression):
+            raise Exception("Unknown compression : %s" % compression)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.compression = compression
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.filenameTemplate = filenameTemplate
+        # hostname -> [lock, open plain file, size of the file]
+        self._hosts = {}
+        self._hostsLock = Lock()
+
+    def path(self, hostname):
+        """Returns the path of the snapshot file of the host"""
+        filename = self.filenameTemplate.format(host = hostname)
+        if self.compression:
+            filename += self.EXTENSIONS[self.compression]
+        return os.path.join(self.directory, filename)
+
+    def write(self, hostname, lines):
+        """Write the lines of a dump of the host, with a timestamp on the header line"""
+        block = "%s : %s" % (datetime.now().strftime(SNAPSHOT_DATE_FORMAT), formatSnapshot(hostname, lines))
+        state = self._state(hostname)
+        path = self.path(hostname)
+        with state[0]:
+            if self.compression:
+                f = self._open(hostname)
+                try:
+                    f.write(block)
+                finally:
+                    f.close()
+                state[2] = os.path.getsize(path)
+            else:
+                if state[1] is None:
+                    state[1] = self._open(hostname)
+                    state[2] = os.path.getsize(path)
+                state[1].write(block)
+                state[1].flush()
+                state[2] += len(block)
+            if self.maxBytes is not None and state[2] >= self.maxBytes:
+                if state[1] is not None:
+                    state[1].close()
+                    state[1] = None
+                self._rotate(hostname)
+
+    def close(self):
+        """Close the files of all the hosts"""
+        with self._hostsLock:
+            states = self._hosts.values()
+        for state in states:
+            with state[0]:
+                if state[1] is not None:
+                    state[1].close()
+                    state[1] = None
+
+    def _state(self, hostname):
+        state = self._hosts.get(hostname)
+        if state is None:
+            with self._hostsLock:
+                state = self._hosts.setdefault(hostname, [Lock(), None, 0])
+        return state
+
+    def _open(self, hostname):
+        return openFile(self.path(hostname), 'ab', self.compression or False)
+
+    def _rotate(self, hostname):
+        """Shift file.n to file.n+1 (dropping the older ones), the current file becomes file.1"""
+        path = self.path(hostname)
+        if self.backupCount <= 0:
+            os.remove(path)
+            return
+        for i in range(self.backupCount - 1, 0, -1):
+            source = "%s.%d" % (path, i)
+            if os.path.exists(source):
+                target = "%s.%d" % (path, i + 1)
+                if os.path.exists(target):
+                    os.remove(target)
+                os.rename(source, target)
+        target = path + ".1"
+        if os.path.exists(target):
+            os.remove(target)
+        os.rename(path, target)
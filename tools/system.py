@@ -2,24 +2,145 @@
 
 """
 
-__all__ = ['Console', 'DirectoryManager']
+__all__ = ['Console', 'DirectoryManager', 'DirectoryLookup', 'TtlCache',
+           'DirectoryBackend', 'ShellDirectoryBackend', 'LdapDirectoryBackend', 'FileDirectoryBackend']
 
+from abc import ABCMeta, abstractmethod
+import binascii
+from collections import OrderedDict, deque
+import cPickle
+import os
+from Queue import Queue
 from subprocess import Popen, PIPE
 import re
+import tempfile
+from threading import Lock, Thread, Event
+import time
 
 
 class Console(object):
     """
     Object to send commands to the shell (in a subprocess)
+
+    By default each command spawns a shell, startWorkers switches to persistent shells (see Console.Worker)
+    The results of the commands can be cached (see enableCache)
     """
 
+    # idle workers when the persistent mode is on
+    _workers = None
+    _allWorkers = []
+    # results of the commands when the cache is on, (pattern, ttl) of the cached commands
+    _cache = None
+    _cacheTtls = []
+    _defaultCacheTtl = 0
+    # commands being executed (single flight), number of callers which waited for another one
+    _flights = {}
+    _flightsLock = Lock()
+    sharedCommands = 0
+
     @staticmethod
-    def sendCommand(command, sendExtraLine = False):
+    def sendCommand(command, sendExtraLine = False, cacheTtl = None):
         """Sends a command to the console
         returns an object representing the result
         an extra line is sent if required, eg because of mks neck message
+
+        When the cache is on, the result of a cached command (see enableCache, cacheTtl overrides its ttl)
+        is given to all the callers until it expires, concurrent callers share a single execution
+        Results with errors are not cached
         
         """
+        cache = Console._cache
+        if cache is None:
+            return Console._execute(command, sendExtraLine)
+        if cacheTtl is None:
+            cacheTtl = Console._commandTtl(command)
+        if cacheTtl <= 0:
+            return Console._execute(command, sendExtraLine)
+        key = (command, sendExtraLine)
+        result = cache.get(key)
+        if result is not TtlCache.MISSING:
+            return result
+        with Console._flightsLock:
+            flight = Console._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                Console._flights[key] = flight
+            else:
+                Console.sharedCommands += 1
+        if not leader:
+            flight.done.wait()
+            if flight.result is not None:
+                return flight.result
+            # the execution failed for the other caller
+            return Console._execute(command, sendExtraLine)
+        try:
+            result = Console._execute(command, sendExtraLine)
+            if not result.hasErrors():
+                cache.put(key, result, cacheTtl)
+            flight.result = result
+            return result
+        finally:
+            with Console._flightsLock:
+                del Console._flights[key]
+            flight.done.set()
+
+    @staticmethod
+    def enableCache(defaultTtl = 0, ttls = None, maxSize = None):
+        """Cache the results of the commands (see sendCommand)
+
+        defaultTtl - time (in seconds) the results of the commands are cached, 0 to cache only the commands
+            matching ttls or sent with a cacheTtl (commands changing something must not be cached)
+        ttls - list of (regular expression, ttl) : results of the commands matching the expression
+            are cached ttl seconds (first match)
+        maxSize - number of results cached
+
+        """
+        Console._cacheTtls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or [])]
+        Console._defaultCacheTtl = defaultTtl
+        if Console._cache is None:
+            Console._cache = TtlCache(maxSize)
+
+    @staticmethod
+    def disableCache():
+        Console._cache = None
+
+    @staticmethod
+    def cacheEnabled():
+        return Console._cache is not None
+
+    @staticmethod
+    def cacheStatistics():
+        """Returns a dictionary of the hits and misses of the cache, and of the callers which shared
+        the execution of another caller
+
+        """
+        cache = Console._cache
+        if cache is None:
+            return {'hits': 0, 'misses': 0, 'shared': Console.sharedCommands}
+        return {'hits': cache.hits, 'misses': cache.misses, 'shared': Console.sharedCommands}
+
+    @staticmethod
+    def _commandTtl(command):
+        for pattern, ttl in Console._cacheTtls:
+            if pattern.search(command):
+                return ttl
+        return Console._defaultCacheTtl
+
+    @staticmethod
+    def _execute(command, sendExtraLine):
+        workers = Console._workers
+        if workers is not None:
+            worker = workers.get()
+            try:
+                return worker.execute(command, sendExtraLine)
+            finally:
+                workers.put(worker)
+        return Console.spawnCommand(command, sendExtraLine)
+
+    @staticmethod
+    def spawnCommand(command, sendExtraLine = False):
+        """Sends a command to a new shell (see sendCommand)"""
         proc = Popen(command, shell = True, stdin = PIPE, stderr = PIPE, stdout = PIPE)
         if sendExtraLine:
             proc.stdin.write('\n')
@@ -34,6 +155,128 @@ class Console(object):
 
         return Console.Result(returnCode, resOut, resErr)
 
+    @staticmethod
+    def streamCommand(command, sendExtraLine = False, tailSize = None):
+        """Sends a command to a new shell, returns a Console.StreamingResult : the output lines are read
+        from the pipe while iterating over the result, only the last tailSize lines of errors are kept
+
+        """
+        proc = Popen(command, shell = True, stdin = PIPE, stderr = PIPE, stdout = PIPE)
+        if sendExtraLine:
+            proc.stdin.write('\n')
+        proc.stdin.close()
+        return Console.StreamingResult(proc, tailSize)
+
+    @staticmethod
+    def startWorkers(count = 1):
+        """Send the commands to count persistent shells instead of spawning a shell per command
+        count is the number of commands which can run at the same time
+
+        Returns False if persistent shells are not available (they need a posix shell)
+
+        """
+        if os.name != 'posix':
+            return False
+        if Console._workers is not None:
+            return True
+        workers = Queue()
+        for _ in range(count):
+            worker = Console.Worker()
+            Console._allWorkers.append(worker)
+            workers.put(worker)
+        Console._workers = workers
+        return True
+
+    @staticmethod
+    def stopWorkers():
+        """Go back to a shell per command, the persistent shells end after their current command"""
+        workers = Console._workers
+        if workers is None:
+            return
+        Console._workers = None
+        allWorkers, Console._allWorkers = Console._allWorkers, []
+        for _ in allWorkers:
+            workers.get().close()
+
+    class Worker(object):
+        """Persistent shell running the commands one at a time
+
+        Each command runs in a subshell (so that cd, exit... do not change the shell) with stdin from
+        /dev/null and stderr to a temporary file, then a marker line gives its return code :
+            ( eval 'command' ) </dev/null 2>'errors'; printf '\\n\\036%s %d\\n' 'marker' $?
+
+        """
+
+        SHELL = '/bin/sh'
+
+        def __init__(self):
+            fd, self._errorPath = tempfile.mkstemp(prefix = "console", suffix = ".err")
+            os.close(fd)
+            self._marker = "END-%s" % binascii.hexlify(os.urandom(8))
+            self._lock = Lock()
+            self._proc = None
+            self._start()
+
+        def _start(self):
+            with open(os.devnull, 'wb') as devnull:
+                self._proc = Popen([self.SHELL], stdin = PIPE, stdout = PIPE, stderr = devnull)
+
+        @staticmethod
+        def _quote(value):
+            return "'%s'" % value.replace("'", "'\\''")
+
+        def execute(self, command, sendExtraLine = False):
+            """Runs the command, returns a Console.Result"""
+            with self._lock:
+                line = "( eval %s ) 2>%s" % (self._quote(command), self._quote(self._errorPath))
+                if sendExtraLine:
+                    line = "printf '\\n' | " + line
+                else:
+                    line += " </dev/null"
+                line += "; printf '\\n\\036%%s %%d\\n' %s $?\n" % self._quote(self._marker)
+                try:
+                    self._proc.stdin.write(line)
+                    self._proc.stdin.flush()
+                except (IOError, OSError) as e:
+                    self._restart()
+                    return Console.Result(-1, "", "Console worker failed : %s" % e)
+                end = "\036%s " % self._marker
+                output = []
+                while True:
+                    outputLine = self._proc.stdout.readline()
+                    if outputLine == "":
+                        # the shell died
+                        self._restart()
+                        return Console.Result(-1, "".join(output), "Console worker terminated")
+                    if outputLine.startswith(end):
+                        returnCode = int(outputLine[len(end):])
+                        break
+                    output.append(outputLine)
+                # the marker printf starts with a new line
+                result = "".join(output)[:-1]
+                with open(self._errorPath, 'rb') as f:
+                    errors = f.read()
+                return Console.Result(returnCode, result, errors)
+
+        def _restart(self):
+            self._stop()
+            self._start()
+
+        def _stop(self):
+            try:
+                self._proc.stdin.close()
+            except (IOError, OSError):
+                pass
+            self._proc.wait()
+            self._proc.stdout.close()
+
+        def close(self):
+            """End the shell"""
+            with self._lock:
+                self._stop()
+                if os.path.exists(self._errorPath):
+                    os.remove(self._errorPath)
+
     class Result(object):
         """Represents a Result from a command"""
 
@@ -41,6 +284,7 @@ class Console(object):
             self.__returnCode = returnCode
             self.__result = result
             self.__errors = errors
+            self.__splitResult = None
 
         def getReturnCode(self):
             return self.__returnCode
@@ -57,11 +301,510 @@ class Console(object):
             return self.__returnCode != 0 or self.__errors != ""
 
         def getSplitResult(self):
-            return self.getResult().splitlines()
+            """Returns the lines of the result, a new list on each call (cached results are shared by the callers)"""
+            if self.__splitResult is None:
+                self.__splitResult = tuple(self.getResult().splitlines())
+            return list(self.__splitResult)
+
+    class StreamingResult(Result):
+        """Result of a running command (see streamCommand)
+
+        Iterating over it gives the output lines (without end of line) as they are read from the pipe,
+        in constant memory, the errors are read by a thread which keeps only their last lines
+
+        getResult and getSplitResult read the whole output at once, they can not be used once the
+        iteration has started, the other methods wait for the end of the command
+
+        """
+
+        DEFAULT_TAIL_SIZE = 100
+
+        def __init__(self, proc, tailSize = None):
+            if tailSize is None: tailSize = self.DEFAULT_TAIL_SIZE
+            self._proc = proc
+            self._returnCode = None
+            self._result = None
+            self._splitResult = None
+            self._iterated = False
+            self._errorTail = deque(maxlen = tailSize)
+            self._errorSize = 0
+            self._errorReader = Thread(target = self._readErrors, name = "ConsoleErrors")
+            self._errorReader.daemon = True
+            self._errorReader.start()
+
+        def _readErrors(self):
+            for line in iter(self._proc.stderr.readline, ''):
+                self._errorSize += len(line)
+                self._errorTail.append(line)
+            self._proc.stderr.close()
+
+        def __iter__(self):
+            if self._result is not None:
+                for line in self.getSplitResult():
+                    yield line
+                return
+            if self._iterated:
+                raise Exception("The output of the command was already read")
+            self._iterated = True
+            for line in iter(self._proc.stdout.readline, ''):
+                yield line.rstrip('\r\n')
+            self._finish()
+
+        def _finish(self):
+            if self._returnCode is None:
+                self._proc.stdout.close()
+                self._returnCode = self._proc.wait()
+                self._errorReader.join()
+
+        def _materialize(self):
+            """Reads the whole output, if it was not read by an iteration"""
+            if self._result is None and not self._iterated:
+                self._result = self._proc.stdout.read()
+                self._finish()
+            elif self._iterated and self._returnCode is None:
+                # iteration stopped before the end, the rest of the output is dropped
+                for _ in iter(self._proc.stdout.readline, ''):
+                    pass
+                self._finish()
+
+        def getReturnCode(self):
+            self._materialize()
+            return self._returnCode
+
+        def getResult(self):
+            if self._iterated:
+                raise Exception("The output of the command was read by an iteration")
+            self._materialize()
+            return self._result
+
+        def getSplitResult(self):
+            if self._splitResult is None:
+                self._splitResult = tuple(self.getResult().splitlines())
+            return list(self._splitResult)
+
+        def getErrors(self):
+            """Returns the last lines of the errors (the output if there are none but the command failed)"""
+            self._materialize()
+            errors = "".join(self._errorTail)
+            if self.hasErrors() and errors == "" and self._result is not None:
+                return self._result
+            return errors
+
+        def hasErrors(self):
+            self._materialize()
+            return self._returnCode != 0 or self._errorSize > 0
+
+        @property
+        def truncatedErrors(self):
+            """Whether errors lines were dropped from the tail"""
+            self._materialize()
+            return self._errorSize > sum([len(line) for line in self._errorTail])
+
+        def close(self):
+            """Stop the command if it is still running"""
+            if self._returnCode is None:
+                try:
+                    self._proc.kill()
+                except OSError:
+                    pass
+                self._proc.stdout.close()
+                self._returnCode = self._proc.wait()
+                if not self._iterated:
+                    self._result = ""
+
+
+class _Flight(object):
+    """Execution of a command shared by concurrent callers"""
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+
+
+class TtlCache(object):
+    """Thread safe LRU cache whose entries expire after a time to live
+    None can be cached (eg. negative lookups), use MISSING to know if a key was found
+
+        value = cache.get(key)
+        if value is TtlCache.MISSING:
+            ...
+
+    """
+
+    MISSING = object()
+    DEFAULT_MAX_SIZE = 10000
+    DEFAULT_TTL = 3600
+
+    def __init__(self, maxSize = None, ttl = None):
+        """Create a new cache
+
+        maxSize - number of entries kept, the least recently used are evicted
+        ttl - default time to live (in seconds) of the entries
+
+        """
+        if maxSize is None: maxSize = self.DEFAULT_MAX_SIZE
+        if ttl is None: ttl = self.DEFAULT_TTL
+        self.maxSize = maxSize
+        self.ttl = ttl
+        # key -> (expiry time, value), in least recently used order
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default = MISSING):
+        """Returns the value of key, default if it is not cached or expired"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl = None):
+        """Cache value under key for ttl seconds (default ttl of the cache if None)"""
+        if ttl is None: ttl = self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last = False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hitRate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def save(self, path):
+        """Write the entries which are still valid to path (replaced at once)"""
+        now = time.time()
+        with self._lock:
+            entries = [(key, entry) for key, entry in self._entries.iteritems() if entry[0] > now]
+        temp = path + ".tmp"
+        with open(temp, 'wb') as f:
+            cPickle.dump(entries, f, cPickle.HIGHEST_PROTOCOL)
+        if os.path.exists(path):
+            # windows does not rename over an existing file
+            os.remove(path)
+        os.rename(temp, path)
+
+    def load(self, path):
+        """Add the entries saved in path which are still valid, returns whether the file could be read"""
+        try:
+            with open(path, 'rb') as f:
+                entries = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return False
+        now = time.time()
+        with self._lock:
+            for key, entry in entries:
+                if entry[0] > now:
+                    self._entries.pop(key, None)
+                    self._entries[key] = entry
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last = False)
+        return True
+
+
+class DirectoryBackend(object):
+    """Source of the user emails of a DirectoryLookup (abstract, see find)"""
+
+    __metaclass__ = ABCMeta
+
+    # number of uids given at once to find
+    BATCH_SIZE = 50
+
+    @abstractmethod
+    def find(self, uids):
+        """Returns a dictionary UID (upper case) -> email of the uids found, None if the directory
+        could not be queried (nothing is cached then)
+
+        """
+
+
+class ShellDirectoryBackend(DirectoryBackend):
+    """Queries the windows directory with a command (dsquery by default)
+
+    The query command is a template (see DEFAULT_QUERY_TEMPLATE) : {filter} is replaced by an LDAP filter
+    matching the uids, the command must print "sAMAccountName: uid" then "userPrincipalName: email" lines
+
+    """
+
+    DEFAULT_QUERY_TEMPLATE = 'dsquery * domainroot -filter "(&(objectCategory=person)(objectClass=user){filter})" ' \
+                             '-attr sAMAccountName userPrincipalName -l -limit 0'
+
+    # uids which can be put in a filter and a command line as is
+    UID_PATTERN = re.compile(r"^[\w.-]+$")
+    ATTRIBUTE_PATTERN = re.compile(r"\s*(\w+):\s*(\S*)")
+
+    def __init__(self, queryTemplate = None):
+        if queryTemplate is None: queryTemplate = self.DEFAULT_QUERY_TEMPLATE
+        self.queryTemplate = queryTemplate
+
+    def find(self, uids):
+        uids = [uid for uid in uids if self.UID_PATTERN.match(uid)]
+        if len(uids) == 0:
+            return {}
+        uidFilter = "".join(["(sAMAccountName=%s)" % uid for uid in uids])
+        if len(uids) > 1:
+            uidFilter = "(|%s)" % uidFilter
+        ret = Console.sendCommand(self.queryTemplate.format(filter = uidFilter), False)
+        if ret.getReturnCode() != 0:
+            return None
+        found = {}
+        current = None
+        for singleLine in ret.getSplitResult():
+            lineMatch = self.ATTRIBUTE_PATTERN.match(singleLine)
+            if lineMatch is None:
+                continue
+            attribute = lineMatch.group(1).lower()
+            if attribute == 'samaccountname':
+                current = lineMatch.group(2).upper()
+            elif attribute in ('userprincipalname', 'upn') and current is not None and lineMatch.group(2):
+                found[current] = lineMatch.group(2)
+        return found
+
+
+class LdapDirectoryBackend(DirectoryBackend):
+    """Queries a directory with the LDAP protocol (python-ldap, imported on first query)
+    usable from any host, eg. against the active directory from linux
+
+    """
+
+    DEFAULT_FILTER_TEMPLATE = "(&(objectCategory=person)(objectClass=user){filter})"
+
+    def __init__(self, uri, baseDn, bindDn = None, password = None, uidAttribute = 'sAMAccountName',
+                 emailAttribute = 'userPrincipalName', filterTemplate = None, timeout = 30):
+        """Create a new backend
+
+        uri - uri of the server (eg. ldap://dc.example.com)
+        baseDn - base of the search (eg. DC=example,DC=com)
+        bindDn, password - credentials (anonymous bind if None)
+        uidAttribute, emailAttribute - attributes of the uid and of the email
+        filterTemplate - filter of the search, {filter} is replaced by the filter matching the uids
+        timeout - timeout (in seconds) of the connection and of the searches
+
+        """
+        if filterTemplate is None: filterTemplate = self.DEFAULT_FILTER_TEMPLATE
+        self.uri = uri
+        self.baseDn = baseDn
+        self.bindDn = bindDn
+        self.password = password
+        self.uidAttribute = uidAttribute
+        self.emailAttribute = emailAttribute
+        self.filterTemplate = filterTemplate
+        self.timeout = timeout
+        self._ldap = None
+        self._connection = None
+
+    def find(self, uids):
+        if len(uids) == 0:
+            return {}
+        ldap = self._module()
+        from ldap.filter import escape_filter_chars
+        uidFilter = "".join(["(%s=%s)" % (self.uidAttribute, escape_filter_chars(uid)) for uid in uids])
+        if len(uids) > 1:
+            uidFilter = "(|%s)" % uidFilter
+        try:
+            results = self._connect().search_st(self.baseDn, ldap.SCOPE_SUBTREE, self.filterTemplate.format(filter = uidFilter),
+                                                [self.uidAttribute, self.emailAttribute], timeout = self.timeout)
+        except ldap.LDAPError:
+            # connection lost or refused, reconnect on the next query
+            self._connection = None
+            return None
+        found = {}
+        for dn, attributes in results:
+            # referrals have no dn
+            if dn is None:
+                continue
+            uid = attributes.get(self.uidAttribute)
+            email = attributes.get(self.emailAttribute)
+            if uid and email:
+                found[uid[0].upper()] = email[0]
+        return found
+
+    def _module(self):
+        if self._ldap is None:
+            try:
+                import ldap
+            except ImportError:
+                raise Exception("The python-ldap package is required by LdapDirectoryBackend")
+            self._ldap = ldap
+        return self._ldap
+
+    def _connect(self):
+        if self._connection is None:
+            ldap = self._module()
+            connection = ldap.initialize(self.uri)
+            connection.set_option(ldap.OPT_REFERRALS, 0)
+            connection.set_option(ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+            connection.simple_bind_s(self.bindDn or '', self.password or '')
+            self._connection = connection
+        return self._connection
+
+
+class FileDirectoryBackend(DirectoryBackend):
+    """Local stand-in for the directory : a csv file (uid;email with a header line)
+    The file is read again when it is modified
+
+    """
+
+    BATCH_SIZE = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self._emails = None
+        self._modified = None
+
+    def find(self, uids):
+        try:
+            modified = os.path.getmtime(self.path)
+            if modified != self._modified:
+                self._emails = self._read()
+                self._modified = modified
+        except (IOError, OSError):
+            return None
+        found = {}
+        for uid in uids:
+            email = self._emails.get(uid.upper())
+            if email:
+                found[uid.upper()] = email
+        return found
+
+    def _read(self):
+        from tools.files.definitions import TupleContainer
+        from tools.files.reader import CsvReader
+        with open(self.path, 'rb') as f:
+            return dict((row[0].strip().upper(), row[1].strip()) for row in CsvReader(f, TupleContainer()) if len(row) >= 2)
+
+
+class DirectoryLookup(object):
+    """Resolves user emails through a cache in front of a DirectoryBackend (windows directory by default)
+
+    uids are resolved by batches (one query per BATCH_SIZE uids of the backend), the results
+    (unknown uids included) are cached, the cache can be saved to disk between runs
+
+    """
+
+    DEFAULT_TTL = 24 * 3600
+    DEFAULT_NEGATIVE_TTL = 3600
+
+    def __init__(self, backend = None, ttl = None, negativeTtl = None, maxSize = None, cachePath = None):
+        """Create a new lookup
+
+        backend - DirectoryBackend queried for the uids which are not cached (ShellDirectoryBackend by default)
+        ttl - time (in seconds) an email is cached
+        negativeTtl - time (in seconds) an unknown uid is cached
+        maxSize - number of uids cached
+        cachePath - file where the cache is loaded from and saved to (not persisted if None)
+
+        """
+        if backend is None: backend = ShellDirectoryBackend()
+        if negativeTtl is None: negativeTtl = self.DEFAULT_NEGATIVE_TTL
+        if ttl is None: ttl = self.DEFAULT_TTL
+        self.backend = backend
+        self.negativeTtl = negativeTtl
+        self.cache = TtlCache(maxSize, ttl)
+        self.cachePath = cachePath
+        if cachePath is not None:
+            self.cache.load(cachePath)
+
+    def getEmail(self, uid):
+        """Returns the email of the user, None if unknown"""
+        email = self.cache.get(uid.upper())
+        if email is not TtlCache.MISSING:
+            return email
+        return self._resolve([uid]).get(uid)
+
+    def getEmails(self, uids):
+        """Returns a dictionary uid -> email (None for unknown users), querying the backend only for
+        the uids which are not cached
+
+        """
+        emails = {}
+        missing = []
+        for uid in uids:
+            email = self.cache.get(uid.upper())
+            if email is TtlCache.MISSING:
+                missing.append(uid)
+            else:
+                emails[uid] = email
+        if len(missing) > 0:
+            emails.update(self._resolve(missing))
+        return emails
+
+    def save(self):
+        """Save the cache to cachePath"""
+        try:
+            self.cache.save(self.cachePath)
+        except (IOError, OSError):
+            pass
+
+    def _resolve(self, uids):
+        """Queries the backend for the uids and caches the results"""
+        emails = {}
+        batchSize = self.backend.BATCH_SIZE
+        for start in range(0, len(uids), batchSize):
+            batch = uids[start:start + batchSize]
+            found = self.backend.find(batch)
+            if found is None:
+                # the directory could not be queried, nothing is cached
+                for uid in batch:
+                    emails[uid] = None
+                continue
+            for uid in batch:
+                email = found.get(uid.upper())
+                self.cache.put(uid.upper(), email, None if email is not None else self.negativeTtl)
+                emails[uid] = email
+        if self.cachePath is not None:
+            self.save()
+        return emails
 
 
 class DirectoryManager(object):
-    """Class to query the windows directory service"""
+    """Class to query the directory service (windows directory unless another backend is set)
+    Lookups go through a shared DirectoryLookup (see setLookup and setBackend to configure it)
+
+    """
+
+    _lookup = None
+    _lookupLock = Lock()
+
+    @staticmethod
+    def setLookup(lookup):
+        """Sets the DirectoryLookup used by the DirectoryManager"""
+        DirectoryManager._lookup = lookup
+
+    @staticmethod
+    def setBackend(backend, **kwargs):
+        """Use a new DirectoryLookup on backend, kwargs are given to the DirectoryLookup"""
+        DirectoryManager.setLookup(DirectoryLookup(backend, **kwargs))
+
+    @staticmethod
+    def getLookup():
+        """Returns the DirectoryLookup used by the DirectoryManager (created on first use)"""
+        if DirectoryManager._lookup is None:
+            with DirectoryManager._lookupLock:
+                if DirectoryManager._lookup is None:
+                    DirectoryManager._lookup = DirectoryLookup()
+        return DirectoryManager._lookup
 
     @staticmethod
     def getUserEmailByUid(uid):
@@ -70,16 +813,13 @@ class DirectoryManager(object):
         uid - the windows user name
         
         """
-        command = "dsquery user -samid %s | dsget user -L -upn" % uid
-        ret = Console.sendCommand(command, False)
-        if ret.getReturnCode() != 0:
-            return None
-        ret = ret.getSplitResult()
-        pattern = re.compile(r"\s*upn:\s*([^\s]+)")
-        for singleLine in ret:
-            lineMatch = pattern.match(singleLine)
-            if lineMatch is not None:
-                return lineMatch.group(1)
+        return DirectoryManager.getLookup().getEmail(uid)
 
-        return None
+    @staticmethod
+    def getUserEmailsByUid(uids):
+        """Get the emails of many users at once, returns a dictionary uid -> email (None if unknown)
 
+        uids - the windows user names
+
+        """
+        return DirectoryManager.getLookup().getEmails(uids)